@@ -1,21 +1,37 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, Response, g, render_template, stream_template, stream_with_context, request, redirect, url_for, session, flash, jsonify
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
-from models import Base, User, UserNameChange, Chat, Message
+from models import Chat
 from datetime import datetime, timedelta, timezone
 from functools import wraps
 import os
 import hashlib
 import logging
 from logging.handlers import RotatingFileHandler
+from log_setup import start_queue_logging
 from init_db import init_database
-from sqlalchemy.sql import func
+from dashboard_queries import (fetch_users_page, fetch_groups_page, fetch_totals, fetch_message_counts,
+                               fetch_previews, fetch_conversation_messages, stream_conversations,
+                               format_ist)
+from export import parse_bound, iter_export
+from search import search_messages
+from query_stats import install_query_stats, query_stats
+from pool_stats import pool_status
+from dashboard_cache import DashboardCache
+from markupsafe import Markup
 import pytz
 
 app = Flask(__name__)
 app.secret_key = os.environ.get('FLASK_SECRET_KEY')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL')
 PASSWORD_HASH = os.environ.get('PASSWORD_HASH')  # Store hashed password in env
+DEFAULT_PAGE_SIZE = 50
+DEFAULT_MESSAGE_PAGE_SIZE = 50
+MAX_PREVIEW_SIZE = 20
+# Requests running more queries than this are logged as warnings
+QUERY_BUDGET = int(os.environ.get('QUERY_BUDGET', 10))
+MAX_PAGE_SIZE = 500
+SEARCH_PAGE_SIZE = 20
 
 # Configure logging
 def setup_logging(app):
@@ -37,17 +53,15 @@ def setup_logging(app):
     ))
     file_handler.setLevel(logging.INFO)
     
-    # Remove existing handlers
-    app.logger.handlers = []
-    
-    # Add our handlers
-    app.logger.addHandler(file_handler)
-    app.logger.setLevel(logging.INFO)
+    # Requests only enqueue records; the file is written on a listener thread
+    start_queue_logging(app.logger, [file_handler])
 
 setup_logging(app)
 
 # Initialize database
 engine, DBSession = init_database()
+install_query_stats(app, engine, query_budget=QUERY_BUDGET)
+dashboard_cache = DashboardCache()
 
 def requires_auth(f):
     @wraps(f)
@@ -58,11 +72,55 @@ def requires_auth(f):
         return f(*args, **kwargs)
     return decorated
 
-def get_db_session():
-    db = DBSession()
+def requires_api_auth(f):
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if not session.get('authenticated'):
+            return jsonify({'error': 'Please login first'}), 401
+        return f(*args, **kwargs)
+    return decorated
+
+def get_cutoff_date(days):
+    """Start of the ?days= window. Raises KeyError for unknown values."""
+    # Get current time in UTC
+    now = datetime.now(timezone.utc)
+    
+    if days == 'today':
+        # Set cutoff to start of current day in UTC
+        return now.replace(hour=0, minute=0, second=0, microsecond=0)
+    
+    days_map = {
+        '3days': 3,
+        '7days': 7,
+        'forever': 36500
+    }
+    return now - timedelta(days=days_map[days])
+
+def get_page_size():
+    try:
+        page_size = int(request.args.get('page_size', DEFAULT_PAGE_SIZE))
+    except ValueError:
+        page_size = DEFAULT_PAGE_SIZE
+    return max(1, min(page_size, MAX_PAGE_SIZE))
+
+def get_preview_size():
     try:
-        yield db
-    finally:
+        preview = int(request.args.get('preview', 0))
+    except ValueError:
+        preview = 0
+    return max(0, min(preview, MAX_PREVIEW_SIZE))
+
+def get_db_session():
+    """The session for this request, closed when the request ends."""
+    if 'db' not in g:
+        g.db = DBSession()
+    return g.db
+
+@app.teardown_appcontext
+def close_db_session(exception):
+    # Return the connection to the pool now, not whenever the session is collected
+    db = g.pop('db', None)
+    if db is not None:
         db.close()
 
 @app.errorhandler(Exception)
@@ -91,6 +149,88 @@ def verify():
         flash('An error occurred during login', 'error')
         return redirect(url_for('login'))
 
+def render_view(view_type, days, cutoff_date, page_size, preview_size):
+    """Query one dashboard view and render it to an HTML fragment."""
+    db = get_db_session()
+    pagination = None
+    
+    if view_type == 'users':
+        # One page of users with private messages in the window
+        users, prev_cursor, next_cursor = fetch_users_page(
+            db, cutoff_date, page_size, request.args.get('after'), request.args.get('before')
+        )
+        pagination = {'prev': prev_cursor, 'next': next_cursor, 'page_size': page_size}
+        
+        # Message bodies are fetched by the page when a chat is expanded
+        user_pks = [user.id for user in users]
+        counts = fetch_message_counts(db, 'user', user_pks, cutoff_date)
+        previews = {}
+        if preview_size:
+            previews = fetch_previews(db, 'user', user_pks, cutoff_date, preview_size)
+        data = [{'user': user, 'message_count': counts.get(user.id, 0), 'preview': previews.get(user.id)}
+                for user in users]
+    elif view_type == 'groups':
+        # One page of group chats with messages in the window
+        chats, prev_cursor, next_cursor = fetch_groups_page(
+            db, cutoff_date, page_size, request.args.get('after'), request.args.get('before')
+        )
+        pagination = {'prev': prev_cursor, 'next': next_cursor, 'page_size': page_size}
+        
+        # Message bodies are fetched by the page when a chat is expanded
+        chat_pks = [chat.id for chat in chats]
+        counts = fetch_message_counts(db, 'group', chat_pks, cutoff_date)
+        previews = {}
+        if preview_size:
+            previews = fetch_previews(db, 'group', chat_pks, cutoff_date, preview_size)
+        data = [{'chat': chat, 'message_count': counts.get(chat.id, 0), 'preview': previews.get(chat.id)}
+                for chat in chats]
+    else:  # total view
+        data = fetch_totals(db, cutoff_date)
+    
+    return render_template('partials/view.html',
+                           data=data,
+                           days=days,
+                           view_type=view_type,
+                           pagination=pagination,
+                           preview_size=preview_size)
+
+def stream_dashboard(view_type, days, cutoff_date):
+    """Render every conversation in the window, sending each as it is read.
+
+    The page shell goes out before the first row is fetched and the
+    response is written conversation by conversation, so the browser
+    paints while the query is still running and the worker never holds
+    the whole window. Streamed pages bypass the dashboard cache.
+    """
+    kind = 'user' if view_type == 'users' else 'group'
+    
+    def conversations():
+        db = DBSession()
+        streamed = 0
+        try:
+            for conversation in stream_conversations(db, kind, cutoff_date):
+                streamed += 1
+                yield conversation
+            query_count, query_time = query_stats()
+            app.logger.info(
+                f"Dashboard streamed for view_type: {view_type}, days: {days}, "
+                f"conversations: {streamed}, queries: {query_count}, db time: {query_time:.1f} ms"
+            )
+        except Exception as e:
+            # Headers are already sent; the page ends where the error happened
+            app.logger.error(f'Dashboard stream error: {str(e)}')
+        finally:
+            db.close()
+    
+    response = app.response_class(stream_template('dashboard.html',
+                                                  conversations=conversations(),
+                                                  days=days,
+                                                  view_type=view_type,
+                                                  stream=True))
+    # Keep proxies from buffering the body until it is complete
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
+
 @app.route('/dashboard')
 @requires_auth
 def dashboard():
@@ -98,97 +238,141 @@ def dashboard():
         days = request.args.get('days', 'today')
         view_type = request.args.get('view', 'users')
         
-        # Get current time in UTC
-        now = datetime.now(timezone.utc)
-        
-        if days == 'today':
-            # Set cutoff to start of current day in UTC
-            cutoff_date = now.replace(hour=0, minute=0, second=0, microsecond=0)
-        else:
-            days_map = {
-                '3days': 3,
-                '7days': 7,
-                'forever': 36500
-            }
-            cutoff_date = now - timedelta(days=days_map[days])
+        cutoff_date = get_cutoff_date(days)
+        if request.args.get('stream') == '1' and view_type in ('users', 'groups'):
+            return stream_dashboard(view_type, days, cutoff_date)
         
-        db = next(get_db_session())
+        page_size = get_page_size()
+        preview_size = get_preview_size()
         
-        if view_type == 'users':
-            # First get all unique users with their messages
-            results = (db.query(User, Message.message_text, Message.response_text, Message.timestamp)
-                     .select_from(User)
-                     .join(Message, User.id == Message.user_id)
-                     .join(Chat, Message.chat_id == Chat.id)
-                     .filter(Chat.chat_type == 'private')
-                     .filter(Message.timestamp >= cutoff_date)
-                     .order_by(User.user_id, Message.timestamp.desc())
-                     .all())
-            
-            # Group messages by user
-            data = {}
-            for row in results:
-                user = row[0]
-                message = {
-                    'message_text': row[1],
-                    'response_text': row[2],
-                    'timestamp': row[3]
-                }
-                if user.user_id not in data:
-                    data[user.user_id] = {'user': user, 'messages': []}
-                data[user.user_id]['messages'].append(message)
-            data = list(data.values())
-        elif view_type == 'groups':
-            results = (db.query(Chat, Message.message_text, Message.response_text, Message.timestamp, User)
-                     .select_from(Chat)
-                     .join(Message, Chat.id == Message.chat_id)
-                     .join(User, Message.user_id == User.id)
-                     .filter(Chat.chat_type.in_(['supergroup', 'group']))
-                     .filter(Message.timestamp >= cutoff_date)
-                     .order_by(Chat.chat_id, Message.timestamp.desc())
-                     .all())
-            
-            # Group messages by chat
-            data = {}
-            for row in results:
-                chat = row[0]  # Use the full Chat object
-                message = {
-                    'message_text': row[1],
-                    'response_text': row[2],
-                    'timestamp': row[3],
-                    'user': row[4]
-                }
-                if chat.chat_id not in data:
-                    data[chat.chat_id] = {'chat': chat, 'messages': []}
-                data[chat.chat_id]['messages'].append(message)
-            data = list(data.values())
-        else:  # total view
-            # Get users with their message counts within the time period
-            results = (db.query(User, func.count(Message.id).label('message_count'))
-                     .join(Message, User.id == Message.user_id)
-                     .filter(Message.timestamp >= cutoff_date)
-                     .group_by(User)
-                     .order_by(User.user_id)
-                     .all())
-            
-            # Convert to list of users with message count
-            data = []
-            for user, count in results:
-                user.message_count = count  # Add message count as attribute
-                data.append(user)
+        # Rendered views are shared by all workers until the next import
+        cache_key = '|'.join(str(part) for part in [
+            view_type, days, cutoff_date.date(), request.args.get('after'),
+            request.args.get('before'), page_size, preview_size
+        ])
+        content = dashboard_cache.get(cache_key)
+        cached = content is not None
+        if not cached:
+            generation = dashboard_cache.generation()
+            content = render_view(view_type, days, cutoff_date, page_size, preview_size)
+            dashboard_cache.set(cache_key, content, generation)
         
-        app.logger.info(f"Dashboard loaded successfully for view_type: {view_type}, days: {days}")
+        query_count, query_time = query_stats()
+        app.logger.info(
+            f"Dashboard loaded successfully for view_type: {view_type}, days: {days}, "
+            f"cached: {cached}, queries: {query_count}, db time: {query_time:.1f} ms"
+        )
         return render_template('dashboard.html', 
-                             data=data, 
+                             content=Markup(content), 
                              days=days, 
                              view_type=view_type,
-                             timezone=timezone,
-                             timedelta=timedelta)
+                             preview_size=preview_size)
     except Exception as e:
         app.logger.error(f'Dashboard error: {str(e)}')
         flash('An error occurred while loading the dashboard', 'error')
         return redirect(url_for('login'))
 
+@app.route('/api/conversations/<kind>/<conversation_id>/messages')
+@requires_api_auth
+def conversation_messages(kind, conversation_id):
+    """One page of a conversation's messages, newest first.
+
+    `kind` is 'user' (the user's private chat) or 'group' (a group chat).
+    Pass the returned next_cursor as ?cursor= to get the following page.
+    """
+    try:
+        cutoff_date = get_cutoff_date(request.args.get('days', 'today'))
+    except KeyError:
+        return jsonify({'error': 'Unknown days value'}), 400
+    try:
+        limit = max(1, min(int(request.args.get('limit', DEFAULT_MESSAGE_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        return jsonify({'error': 'Invalid limit'}), 400
+    
+    try:
+        db = get_db_session()
+        if kind not in ('user', 'group'):
+            return jsonify({'error': 'Unknown conversation kind'}), 404
+        try:
+            messages, next_cursor = fetch_conversation_messages(
+                db, kind, conversation_id, cutoff_date, limit, request.args.get('cursor')
+            )
+        except ValueError:
+            return jsonify({'error': 'Invalid cursor'}), 400
+        
+        return jsonify({'messages': messages, 'next_cursor': next_cursor})
+    except Exception as e:
+        app.logger.error(f'Conversation messages error: {str(e)}')
+        return jsonify({'error': 'An error occurred while loading messages'}), 500
+
+@app.route('/search')
+@requires_auth
+def search():
+    """Ranked full-text search over message and response text."""
+    query_text = request.args.get('q', '').strip()
+    days = request.args.get('days', 'forever')
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+    except ValueError:
+        page = 1
+    
+    try:
+        cutoff_date = get_cutoff_date(days)
+        db = get_db_session()
+        results, has_more = search_messages(db, query_text, SEARCH_PAGE_SIZE,
+                                            offset=(page - 1) * SEARCH_PAGE_SIZE,
+                                            cutoff_date=cutoff_date)
+        query_count, query_time = query_stats()
+        app.logger.info(
+            f"Search for '{query_text}', days: {days}, page: {page}, results: {len(results)}, "
+            f"queries: {query_count}, db time: {query_time:.1f} ms"
+        )
+        return render_template('search.html',
+                               query=query_text,
+                               days=days,
+                               page=page,
+                               has_more=has_more,
+                               results=results,
+                               format_ist=format_ist)
+    except Exception as e:
+        app.logger.error(f'Search error: {str(e)}')
+        flash('An error occurred while searching', 'error')
+        return redirect(url_for('dashboard'))
+
+@app.route('/export')
+@requires_auth
+def export_history():
+    """Messages as a temp_history.txt download, written while it is read.
+
+    Optional filters: ?from= and ?to= (YYYY-MM-DD or ISO timestamps, UTC;
+    a bare ?to= date is inclusive), ?chat= and ?user= (Telegram ids).
+    """
+    try:
+        filters = {
+            'start': parse_bound(request.args.get('from')),
+            'end': parse_bound(request.args.get('to'), end=True),
+            'chat_id': request.args.get('chat') or None,
+            'user_id': request.args.get('user') or None,
+        }
+    except ValueError:
+        return jsonify({'error': 'Invalid from/to value'}), 400
+    
+    def generate():
+        db = DBSession()
+        try:
+            yield from iter_export(db, **filters)
+            app.logger.info(f"Export streamed with filters: {filters}")
+        except Exception as e:
+            # Headers are already sent; the download ends where the error happened
+            app.logger.error(f'Export error: {str(e)}')
+        finally:
+            db.close()
+    
+    return Response(stream_with_context(generate()),
+                    mimetype='text/plain',
+                    headers={'Content-Disposition': 'attachment; filename=temp_history.txt',
+                             'X-Accel-Buffering': 'no'})
+
 @app.route('/logout')
 def logout():
     session.clear()
@@ -199,7 +383,7 @@ def logout():
 @requires_auth
 def debug_chats():
     try:
-        db = next(get_db_session())
+        db = get_db_session()
         # Get all chats
         chats = db.query(Chat).filter(
             Chat.chat_type.in_(['group', 'supergroup'])
@@ -218,5 +402,11 @@ def debug_chats():
         app.logger.error(f"Debug error: {str(e)}")
         return jsonify({'error': str(e)})
 
+@app.route('/debug/pool')
+@requires_auth
+def debug_pool():
+    """Connection pool state and counters for the worker serving this request."""
+    return jsonify(pool_status(engine))
+
 if __name__ == '__main__':
     app.run(debug=True) 
\ No newline at end of file
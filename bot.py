@@ -1,20 +1,38 @@
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from sqlalchemy.orm import Session
-from models import User, UserNameChange, Chat, Message
+from sqlalchemy.orm import Session, sessionmaker
+from models import User, UserNameChange, Chat, Message, DailyActivity, Meta
+from history import parse_history
+from export import parse_bound, write_export
+from search import clear_search_index
+from import_stats import ImportStats
+from log_setup import LogSampler, start_queue_logging
+from uploads import Upload
+from ingest import BulkLoader, entry_hash
+from transliteration import Transliterator, Replacer, TransliterationStore
+from dashboard_cache import DashboardCache
 import os
-from datetime import datetime
 import logging
-from init_db import init_database
+from init_db import init_database, REPLACE_ON_NEXT_IMPORT
 import tempfile
+import asyncio
+import time
 
 TELEGRAM_TOKEN = os.environ.get('TELEGRAM_TOKEN')
 RENDER_URL = os.environ.get('RENDER_URL')
+# 'merge' appends only new messages, 'replace' reloads everything
+IMPORT_MODE = os.environ.get('IMPORT_MODE', 'merge')
+IMPORT_BATCH_SIZE = int(os.environ.get('IMPORT_BATCH_SIZE', 5000))
+# Seconds between progress updates while an import runs
+PROGRESS_INTERVAL = float(os.environ.get('PROGRESS_INTERVAL', 10))
+TRANSLITERATION_CACHE_SIZE = int(os.environ.get('TRANSLITERATION_CACHE_SIZE', 50000))
 
 class Bot:
-    def __init__(self, db_session: Session):
-        self.db = db_session
+    def __init__(self, session_factory: sessionmaker):
+        # Every update or job checks out its own session from the pool
+        self.SessionLocal = session_factory
         self.last_file_chat_id = None
+        self.dashboard_cache = DashboardCache()
         self.logger = logging.getLogger(__name__)
         # Extended Hindi to English character mapping
         self.hindi_to_eng = {
@@ -83,46 +101,8 @@ class Bot:
             'वाला': 'wala', 'वाली': 'wali', 'कार': 'kar',
             'पूर्व': 'purv', 'पूर्ण': 'purn', 'योग': 'yog',
         }
-        
-    def update_user_info(self, user_data):
-        try:
-            user = self.db.query(User).filter_by(user_id=user_data['User ID']).first()
-            
-            if user:
-                # Check if name or username changed
-                if (user.current_username != user_data['Username'] or
-                    user.current_firstname != user_data['First Name'] or
-                    user.current_lastname != user_data['Last Name']):
-                    
-                    # Record the change
-                    name_change = UserNameChange(
-                        user=user,
-                        old_username=user.current_username,
-                        old_firstname=user.current_firstname,
-                        old_lastname=user.current_lastname
-                    )
-                    self.db.add(name_change)
-                    
-                    # Update current info
-                    user.current_username = user_data['Username']
-                    user.current_firstname = user_data['First Name']
-                    user.current_lastname = user_data['Last Name']
-            else:
-                # Create new user
-                user = User(
-                    user_id=user_data['User ID'],
-                    current_username=user_data['Username'],
-                    current_firstname=user_data['First Name'],
-                    current_lastname=user_data['Last Name']
-                )
-                self.db.add(user)
-                
-            self.db.commit()
-            return user
-        except Exception as e:
-            self.logger.error(f"Error updating user info: {str(e)}")
-            self.db.rollback()
-            raise
+        self.transliterator = Transliterator(self.hindi_to_eng)
+        self.transliterations = TransliterationStore(capacity=TRANSLITERATION_CACHE_SIZE)
         
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Hi! I'm waiting for temp_history.txt file.")
@@ -143,125 +123,238 @@ class Bot:
 
     def transliterate_hindi(self, text):
         """Convert Hindi text to Roman/English characters"""
-        result = ''
-        skip_next = False
-        for i, char in enumerate(text):
-            if skip_next:
-                skip_next = False
-                continue
-                
-            if char in self.hindi_to_eng:
-                # Look ahead for combined characters
-                if i < len(text) - 1 and text[i + 1] in ['्', 'ा', 'ि', 'ी', 'ु', 'ू', 'े', 'ै', 'ो', 'ौ']:
-                    combined = char + text[i + 1]
-                    result += self.hindi_to_eng.get(combined, self.hindi_to_eng[char] + self.hindi_to_eng[text[i + 1]])
-                    skip_next = True
-                else:
-                    result += self.hindi_to_eng[char]
-            else:
-                result += char
-        return result
+        return self.transliterator.transliterate(text)
 
-    async def process_history_file(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        temp_filename = None
+    def clear_data(self, db: Session):
+        """Delete all imported data, in foreign key order. The caller commits."""
+        self.logger.info("Clearing existing data from database")
+        db.query(UserNameChange).delete()
+        db.query(DailyActivity).delete()
+        clear_search_index(db)
+        db.query(Message).delete()
+        db.query(Chat).delete()
+        db.query(User).delete()
+
+    def replace_required(self):
+        """True until a 'replace' import follows a message_hash backfill."""
+        with self.SessionLocal() as db:
+            return db.get(Meta, REPLACE_ON_NEXT_IMPORT) is not None
+
+    def import_entries(self, db: Session, entries, transliterations=None, mode='merge', loader=None, stats=None):
+        """Write parsed (entry_num, chat_info) pairs to the database in batches.
+
+        In 'merge' mode only messages not already stored are written; in
+        'replace' mode all existing data is deleted first. Both happen in the
+        caller's transaction, so the dashboard keeps the old data until the
+        caller commits. Returns the BulkLoader with the import counters;
+        pass one in to watch its counters while the import runs, and an
+        ImportStats to collect stage timings.
+        """
+        stats = stats or ImportStats(profile='')
+        if mode == 'replace':
+            with stats.stage('clear'):
+                self.clear_data(db)
+            # Once this commits, stored hashes match raw uploads again
+            db.query(Meta).filter(Meta.key == REPLACE_ON_NEXT_IMPORT).delete()
+        
+        if loader is None:
+            loader = BulkLoader(db, batch_size=IMPORT_BATCH_SIZE)
+        # Compiled once for the whole import, applied in one pass per field
+        replacer = Replacer({hindi: f"{english}*" for hindi, english in (transliterations or {}).items()})
+        
+        # Parsing is interleaved with the other stages, so time them on one clock
+        clock = time.perf_counter()
+        for entry_num, chat_info in entries:
+            clock = stats.lap('parse', clock)
+            # Identity comes from the entry as uploaded, before transliteration
+            key = entry_hash(chat_info)
+            
+            # Apply transliterations to text fields
+            if transliterations:
+                for field in ['First Name', 'Last Name', 'Username', 'Chat Name', 'Message', 'Response']:
+                    if field in chat_info and chat_info[field]:
+                        chat_info[field] = replacer.replace(chat_info[field])
+            clock = stats.lap('apply_transliterations', clock)
+            
+            loader.add(entry_num, chat_info, message_hash=key)
+            clock = stats.lap('insert', clock)
+        stats.lap('parse', clock)
+        
+        with stats.stage('insert'):
+            loader.flush()
+        stats.set('entries', loader.valid_entries + loader.skipped_entries)
+        stats.set('new_entries', loader.new_entries)
+        stats.set('duplicate_entries', loader.duplicate_entries)
+        stats.set('skipped_entries', loader.skipped_entries)
+        stats.set('rows_written', loader.rows_written)
+        return loader
+
+    def read_history_file(self, source):
+        """Stream parsed entries from an Upload or a history file on disk."""
+        if isinstance(source, Upload):
+            yield from parse_history(source.lines())
+            return
+        with open(source, "r", encoding='utf-8') as f:
+            yield from parse_history(f)
+
+    def close_upload(self, upload):
         try:
-            self.logger.info("Starting file processing")
-            file = await context.bot.get_file(update.message.document.file_id)
-            
-            # Use tempfile module to handle file cleanup automatically
-            with tempfile.NamedTemporaryFile(delete=False, suffix='.txt') as temp_file:
-                temp_filename = temp_file.name
-                await file.download_to_drive(temp_filename)
-            
-            # Clear existing data in correct order
-            self.logger.info("Clearing existing data from database")
+            upload.close()
+        except Exception as e:
+            self.logger.error(f"Error cleaning up upload: {str(e)}")
+
+    def discard_pending_upload(self, context: ContextTypes.DEFAULT_TYPE):
+        """Release the upload kept while its transliterations are reviewed."""
+        upload = context.user_data.pop('upload', None)
+        context.user_data.pop('transliterations', None)
+        context.user_data.pop('import_mode', None)
+        context.user_data.pop('import_stats', None)
+        if upload is not None:
+            self.close_upload(upload)
+
+    def scan_history_file(self, source, stats=None):
+        """Collect Hindi words in a history file and split them into known and new.
+
+        Returns (entry_count, known_transliterations, new_transliterations).
+        Blocking: reads the whole file and queries the database.
+        """
+        stats = stats or ImportStats(profile='')
+        hindi_words = set()
+        entry_count = 0
+        # Per-entry lines for a sample only; the totals are logged below
+        sample = LogSampler()
+        
+        clock = time.perf_counter()
+        for entry_num, chat_info in self.read_history_file(source):
+            clock = stats.lap('parse', clock)
+            entry_count += 1
+            if sample():
+                self.logger.info(f"Scanning entry {entry_num}: {sorted(chat_info)}")
+            
+            # Find Hindi words in all text fields
+            for field in ['First Name', 'Last Name', 'Username', 'Chat Name', 'Message', 'Response']:
+                if field in chat_info and chat_info[field]:
+                    hindi_words.update(self.find_hindi_words(chat_info[field]))
+            clock = stats.lap('hindi_detection', clock)
+        stats.lap('parse', clock)
+        stats.set('entries', entry_count)
+        stats.set('hindi_words', len(hindi_words))
+        
+        self.logger.info(
+            f"Entries collected for processing: {entry_count} "
+            f"({sample.suppressed} per-entry log lines not written)"
+        )
+        
+        # Reviewed and corrected words come from the store; only new ones are transliterated
+        with stats.stage('lookup'), self.SessionLocal() as db:
+            known_transliterations = self.transliterations.lookup(db, hindi_words)
+        with stats.stage('transliteration'):
+            new_transliterations = {
+                word: self.transliterate_hindi(word)
+                for word in hindi_words if word not in known_transliterations
+            }
+        self.logger.info(
+            f"Hindi words: {len(hindi_words)}, known: {len(known_transliterations)}, "
+            f"new: {len(new_transliterations)}"
+        )
+        return entry_count, known_transliterations, new_transliterations
+
+    def invalidate_dashboard(self):
+        """Tell the dashboard workers that cached views are out of date."""
+        try:
+            self.dashboard_cache.bump_generation()
+        except Exception as e:
+            self.logger.error(f"Error invalidating dashboard cache: {str(e)}")
+
+    async def run_import(self, update: Update, source, transliterations=None, mode='merge',
+                         save_transliterations=False, stats=None):
+        """Import an Upload or history file in a worker thread, posting progress while it runs.
+
+        Returns the BulkLoader with the final counters. The import is
+        committed, or rolled back and the error re-raised. Stage timings
+        are added to `stats`.
+        """
+        stats = stats or ImportStats()
+        # Created here so progress can be read, used only by the worker thread
+        db = self.SessionLocal()
+        loader = BulkLoader(db, batch_size=IMPORT_BATCH_SIZE)
+        
+        def work():
             try:
-                self.db.query(UserNameChange).delete()
-                self.db.query(Message).delete()
-                self.db.query(Chat).delete()
-                self.db.query(User).delete()
-                self.db.commit()
-                self.logger.info("Successfully cleared existing data")
-            except Exception as e:
-                self.db.rollback()
-                self.logger.error(f"Error clearing data: {str(e)}")
+                with stats.profiling():
+                    if save_transliterations:
+                        # Accepted suggestions are remembered so they are not reviewed again
+                        with stats.stage('save_transliterations'):
+                            self.transliterations.save(db, transliterations)
+                    self.import_entries(db, self.read_history_file(source), transliterations,
+                                        mode=mode, loader=loader, stats=stats)
+                    with stats.stage('commit'):
+                        db.commit()
+                    stats.count('commits')
+                self.invalidate_dashboard()
+            except Exception:
+                db.rollback()
                 raise
+            finally:
+                db.close()
+        
+        status = await update.message.reply_text("Importing...")
+        task = asyncio.ensure_future(asyncio.to_thread(work))
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=PROGRESS_INTERVAL)
+            if done:
+                break
+            try:
+                await status.edit_text(
+                    f"Importing...\nRead: {loader.valid_entries + loader.skipped_entries}\n"
+                    f"New: {loader.new_entries}"
+                )
+            except Exception as e:
+                self.logger.error(f"Error sending progress: {str(e)}")
+        task.result()
+        return loader
 
-            # Read and parse the file
-            with open(temp_filename, "r", encoding='utf-8') as f:
-                content = f.read()
-            
-            self.logger.info(f"File content length: {len(content)}")
-            
-            # Skip the header "ℹ️ Chat History:"
-            if "ℹ️ Chat History:" in content:
-                content = content.split("ℹ️ Chat History:")[1]
-            
-            # Split entries by the custom separator instead of Time:
-            entries = []
-            current_entry = []
-            
-            for line in content.strip().split('\n'):
-                if line.strip() == "=" * 50:  # Our custom separator
-                    if current_entry:
-                        entries.append('\n'.join(current_entry))
-                        current_entry = []
-                    continue
-                current_entry.append(line)
-            
-            if current_entry:  # Add the last entry
-                entries.append('\n'.join(current_entry))
-            
-            self.logger.info(f"Entries collected for processing: {len(entries)}")
-            
-            # Track Hindi words and their transliterations
-            hindi_word_transliterations = {}
-            all_entries = []
-            
-            for entry_num, entry in enumerate(entries, 1):
-                chat_info = {}
-                lines = entry.strip().split('\n')
-                
-                # Log the raw entry content for debugging
-                self.logger.info(f"\nProcessing Entry {entry_num}:\n")
-                self.logger.info("-" * 50 + "\n")
-                self.logger.info(f"Raw content:\n{entry}\n")
-                
-                for line in lines:
-                    if ': ' in line:
-                        key, value = line.split(': ', 1)
-                        key = key.strip()
-                        value = value.strip() if value else None
-                        chat_info[key] = value
-                
-                if chat_info:  # Only add if we got valid data
-                    all_entries.append((entry_num, chat_info))
-                    # Find Hindi words in all text fields
-                    for field in ['First Name', 'Last Name', 'Username', 'Chat Name', 'Message', 'Response']:
-                        if field in chat_info and chat_info[field]:
-                            hindi_words = self.find_hindi_words(chat_info[field])
-                            for word in hindi_words:
-                                if word not in hindi_word_transliterations:
-                                    transliterated = self.transliterate_hindi(word)
-                                    hindi_word_transliterations[word] = transliterated
+    def log_import_summary(self, stats, label='Import'):
+        """One structured log record with the import's stage timings and counters."""
+        self.logger.info(f"{label} summary: {stats.summary_json()}")
+        try:
+            for path in stats.write_profile():
+                self.logger.info(f"{label} profile written to {path}")
+        except Exception as e:
+            self.logger.error(f"Error writing import profile: {str(e)}")
 
-                required_fields = ['Chat ID', 'Chat Type', 'User ID', 'Username', 'First Name', 'Message', 'Response']
-                missing_fields = [field for field in required_fields if field not in chat_info]
-                
-                if missing_fields:
-                    self.logger.info(f"SKIPPED - Missing fields: {', '.join(missing_fields)}")
-                    self.logger.info("Found fields:")
-                    for key, value in chat_info.items():
-                        self.logger.info(f"  {key}: {value}")
-                else:
-                    self.logger.info("Processed successfully")
-                
-                self.logger.info("-" * 50 + "\n")
+    async def process_history_file(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        upload = None
+        stats = ImportStats()
+        try:
+            self.logger.info("Starting file processing")
+            # A new upload replaces any upload still waiting for review
+            self.discard_pending_upload(context)
+            
+            # Downloaded once; the scan, the import and a pending review all read this copy
+            with stats.stage('download'):
+                file = await context.bot.get_file(update.message.document.file_id)
+                upload = await Upload.download(file, size=update.message.document.file_size)
+            stats.set('bytes', upload.size)
+            
+            # Caption "replace" forces a full reload instead of a merge
+            caption = (update.message.caption or '').strip().lower()
+            mode = 'replace' if caption == 'replace' else IMPORT_MODE
+            if mode != 'replace' and await asyncio.to_thread(self.replace_required):
+                mode = 'replace'
+                await update.message.reply_text(
+                    "Stored messages predate duplicate detection, so this upload replaces all data."
+                )
+            self.logger.info(f"Import mode: {mode}")
+
+            self.logger.info(f"File size: {upload.size} bytes ({'memory' if upload.path is None else 'temp file'})")
             
-            self.logger.info("\nProcessing Summary:")
-            self.logger.info(f"Total entries collected: {len(entries)}")
-            self.logger.info(f"Successfully processed: {len(entries)}")
-            self.logger.info(f"Skipped entries: {0}")
+            # First pass runs in a worker thread so the bot keeps answering
+            def scan():
+                with stats.profiling():
+                    return self.scan_history_file(upload, stats)
+            
+            entry_count, known_transliterations, hindi_word_transliterations = await asyncio.to_thread(scan)
             
             if hindi_word_transliterations:
                 # Split long transliteration messages
@@ -273,10 +366,11 @@ class Bot:
                     line = f"{hindi}: {eng}\n"
                     if len(current_part) + len(line) > MAX_MESSAGE_LENGTH:
                         # Start new part
-                        current_part += "\nContinued in next message..."
+                        report_parts[-1] = current_part + "\nContinued in next message..."
                         report_parts.append("Continuing Hindi words:\n")
                         current_part = report_parts[-1]
                     current_part += line
+                    report_parts[-1] = current_part
                 
                 # Add instructions to the last part
                 report_parts[-1] += "\nReply with any corrections in format:\nword1:replacement1\nword2:replacement2"
@@ -285,262 +379,255 @@ class Bot:
                 for part in report_parts:
                     await update.message.reply_text(part)
                 
-                # Store for later use
-                context.user_data['all_entries'] = entries
-                context.user_data['temp_filename'] = temp_filename
-                context.user_data['transliterations'] = hindi_word_transliterations
+                # Keep the upload for handle_reply, which streams it again
+                context.user_data['upload'] = upload
+                context.user_data['transliterations'] = {**known_transliterations, **hindi_word_transliterations}
+                context.user_data['import_mode'] = mode
+                context.user_data['import_stats'] = stats
+                upload = None
                 return
             
-            required_fields = ['Chat ID', 'Chat Type', 'User ID', 'Username', 'First Name', 'Message', 'Response', 'Time']
-            if all(k in chat_info for k in required_fields):
-                try:
-                    # Update or create chat
-                    chat = self.db.query(Chat).filter_by(chat_id=chat_info['Chat ID']).first()
-                    if not chat:
-                        chat = Chat(
-                            chat_id=chat_info['Chat ID'],
-                            chat_type=chat_info['Chat Type'],
-                            chat_name=chat_info.get('Chat Name')
-                        )
-                        self.db.add(chat)
-                        self.db.flush()
-                    
-                    # Update or create user
-                    user = self.update_user_info({
-                        'User ID': chat_info['User ID'],
-                        'Username': chat_info['Username'],
-                        'First Name': chat_info['First Name'],
-                        'Last Name': chat_info.get('Last Name'),
-                    })
-                    
-                    # Parse timestamp
-                    try:
-                        timestamp = datetime.strptime(chat_info['Time'], '%Y-%m-%d %H:%M:%S.%f')
-                    except ValueError:
-                        timestamp = datetime.strptime(chat_info['Time'], '%Y-%m-%d %H:%M:%S')
-                    
-                    # Create message
-                    message = Message(
-                        user_id=user.id,
-                        chat_id=chat.id,
-                        message_text=chat_info['Message'],
-                        response_text=chat_info['Response'],
-                        timestamp=timestamp
-                    )
-                    self.db.add(message)
-                    
-                except Exception as e:
-                    self.logger.error(f"Error processing entry {entry_num}: {str(e)}")
-            
-            if not all(k in chat_info for k in required_fields):
-                missing = [k for k in required_fields if k not in chat_info]
-                print(f"Entry {entry_num} missing fields: {missing}")
-                print(f"Entry content:\n{entry}")
+            # Second pass: stream entries into the database
+            loader = await self.run_import(update, upload, known_transliterations, mode=mode, stats=stats)
             
-            self.db.commit()
-            self.logger.info(f"Processing complete. Processed: {len(entries)}")
+            self.logger.info(
+                f"Processing complete. Processed: {loader.valid_entries}, New: {loader.new_entries}, "
+                f"Already imported: {loader.duplicate_entries}, Skipped: {loader.skipped_entries}"
+            )
+            self.log_import_summary(stats)
             self.last_file_chat_id = update.effective_chat.id
             await update.message.reply_text(
-                f"DONE\nProcessed: {len(entries)}"
+                f"DONE\nProcessed: {loader.valid_entries}\n"
+                f"New: {loader.new_entries}\n"
+                f"Already imported: {loader.duplicate_entries}\n"
+                f"{stats.report()}"
             )
             
         except Exception as e:
             self.logger.error(f"Error processing file: {str(e)}")
-            self.db.rollback()
             await update.message.reply_text(f"Error processing file: {str(e)}")
         
         finally:
-            # Clean up temp file
-            if temp_filename and os.path.exists(temp_filename):
-                try:
-                    os.unlink(temp_filename)
-                except Exception as e:
-                    self.logger.error(f"Error cleaning up temp file: {str(e)}")
+            if upload is not None:
+                self.close_upload(upload)
         
+    def parse_corrections(self, text, reviewed=None):
+        """Parse 'word:replacement' lines from a review reply.
+
+        Only words under review are accepted, or any Hindi word when no
+        upload is pending, so URLs and ordinary 'x: y' text are not saved
+        as corrections. Returns (corrections, skipped_lines).
+        """
+        corrections = {}
+        skipped = []
+        for line in text.split('\n'):
+            if ':' in line:
+                word, replacement = line.split(':', 1)
+                word, replacement = word.strip(), replacement.strip()
+                if not (word and replacement):
+                    continue
+                accepted = (word in reviewed) if reviewed is not None else self.is_hindi(word)
+                if accepted:
+                    corrections[word] = replacement
+                else:
+                    skipped.append(line.strip())
+        return corrections, skipped
+
     async def handle_reply(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         if (update.message.reply_to_message and 
-            "Found Hindi words with suggested transliterations:" in update.message.reply_to_message.text):
+            any(marker in update.message.reply_to_message.text
+                for marker in ["Found Hindi words with suggested transliterations:", "Continuing Hindi words:"])):
             
             if update.message.text.lower() == "papapiya":
-                # Get stored entries and transliterations
-                entries = context.user_data.get('all_entries', [])
-                transliterations = context.user_data.get('transliterations', {})
-                temp_filename = context.user_data.get('temp_filename')
+                # Claim the stored upload before any await, so a repeated
+                # "papapiya" cannot start a second import of it
+                upload = context.user_data.pop('upload', None)
+                transliterations = context.user_data.pop('transliterations', {})
+                mode = context.user_data.pop('import_mode', IMPORT_MODE)
+                # Continues the timings of the upload's scan; review time is not counted
+                stats = context.user_data.pop('import_stats', None) or ImportStats()
                 
-                if not entries or not temp_filename:
-                    await update.message.reply_text("Session expired. Please upload the file again.")
+                if upload is None or not upload.available:
+                    await update.message.reply_text(
+                        "Nothing to import: already importing, or the session expired. "
+                        "Please upload the file again if needed."
+                    )
                     return
                 
-                valid_entries = 0
-                skipped_entries = 0
+                try:
+                    loader = await self.run_import(
+                        update, upload, transliterations, mode=mode, save_transliterations=True,
+                        stats=stats
+                    )
+                except Exception as e:
+                    self.logger.error(f"Error processing file: {str(e)}")
+                    await update.message.reply_text(f"Error processing file: {str(e)}")
+                    return
+                finally:
+                    self.close_upload(upload)
                 
-                # Process all entries
-                for entry_num, entry in enumerate(entries, 1):
-                    chat_info = {}
-                    lines = entry.strip().split('\n')
-                    
-                    # Parse entry into chat_info
-                    for line in lines:
-                        if ': ' in line:
-                            key, value = line.split(': ', 1)
-                            key = key.strip()
-                            value = value.strip() if value else None
-                            chat_info[key] = value
-                    
-                    # Apply transliterations to text fields
-                    for field in ['First Name', 'Last Name', 'Username', 'Chat Name', 'Message', 'Response']:
-                        if field in chat_info and chat_info[field]:
-                            text = chat_info[field]
-                            for hindi, english in transliterations.items():
-                                text = text.replace(hindi, f"{english}*")
-                            chat_info[field] = text
-                    
-                    # Process the modified entry
-                    required_fields = ['Chat ID', 'Chat Type', 'User ID', 'Username', 'First Name', 'Message', 'Response']
-                    if all(k in chat_info for k in required_fields):
+                self.log_import_summary(stats)
+                await update.message.reply_text(
+                    f"DONE\nProcessed: {loader.valid_entries}\n"
+                    f"New: {loader.new_entries}\n"
+                    f"Already imported: {loader.duplicate_entries}\n"
+                    f"Skipped: {loader.skipped_entries}\n"
+                    f"{stats.report()}"
+                )
+            else:
+                corrections, skipped = self.parse_corrections(
+                    update.message.text, context.user_data.get('transliterations')
+                )
+                skipped_note = ""
+                if skipped:
+                    skipped_note = "Skipped, not words under review:\n" + "\n".join(skipped) + "\n"
+                if not corrections:
+                    await update.message.reply_text(
+                        f"{skipped_note}To accept all transliterations, reply with 'papapiya'"
+                    )
+                    return
+                
+                stats = context.user_data.get('import_stats') or ImportStats(profile='')
+                
+                def save_corrections():
+                    with stats.stage('save_transliterations'), self.SessionLocal() as db:
                         try:
-                            # Update or create chat
-                            chat = self.db.query(Chat).filter_by(chat_id=chat_info['Chat ID']).first()
-                            if not chat:
-                                chat = Chat(
-                                    chat_id=chat_info['Chat ID'],
-                                    chat_type=chat_info['Chat Type'],
-                                    chat_name=chat_info.get('Chat Name')
-                                )
-                                self.db.add(chat)
-                                self.db.flush()
-                            
-                            # Update or create user
-                            user = self.update_user_info({
-                                'User ID': chat_info['User ID'],
-                                'Username': chat_info['Username'],
-                                'First Name': chat_info['First Name'],
-                                'Last Name': chat_info.get('Last Name'),
-                            })
-                            
-                            # Parse timestamp
-                            try:
-                                timestamp = datetime.strptime(chat_info['Time'], '%Y-%m-%d %H:%M:%S.%f')
-                            except ValueError:
-                                timestamp = datetime.strptime(chat_info['Time'], '%Y-%m-%d %H:%M:%S')
-                            
-                            # Create message
-                            message = Message(
-                                user_id=user.id,
-                                chat_id=chat.id,
-                                message_text=chat_info['Message'],
-                                response_text=chat_info['Response'],
-                                timestamp=timestamp
-                            )
-                            self.db.add(message)
-                            valid_entries += 1
-                            
-                        except Exception as e:
-                            self.logger.error(f"Error processing entry {entry_num}: {str(e)}")
-                            skipped_entries += 1
-                    else:
-                        skipped_entries += 1
+                            self.transliterations.save(db, corrections, corrected=True)
+                            db.commit()
+                            stats.count('commits')
+                        except Exception:
+                            db.rollback()
+                            raise
                 
-                self.db.commit()
+                try:
+                    await asyncio.to_thread(save_corrections)
+                except Exception as e:
+                    self.logger.error(f"Error saving corrections: {str(e)}")
+                    await update.message.reply_text(f"Error saving corrections: {str(e)}")
+                    return
+                
+                if 'transliterations' in context.user_data:
+                    context.user_data['transliterations'].update(corrections)
                 await update.message.reply_text(
-                    f"DONE\nProcessed: {valid_entries}\n"
-                    f"Skipped: {skipped_entries}"
+                    f"Saved {len(corrections)} corrections.\n{skipped_note}"
+                    "To accept all transliterations, reply with 'papapiya'"
                 )
-            else:
-                await update.message.reply_text("To accept all transliterations, reply with 'papapiya'")
             
         elif (update.message.reply_to_message and 
               "DONE" in update.message.reply_to_message.text and
               update.message.text.lower() == "papapiya"):
             await update.message.reply_text(f"Here's your URL: {RENDER_URL}")
 
-    def create_history_file(self, messages):
-        history = []
-        for msg in messages:
-            history.append(f"Time: {msg.timestamp}")
-            history.append(f"Chat ID: {msg.chat.chat_id}")
-            history.append(f"Chat Type: {msg.chat.chat_type}")
-            history.append(f"User ID: {msg.user.user_id}")
-            history.append(f"Username: @{msg.user.current_username}" if msg.user.current_username else "Username: None")
-            history.append(f"First Name: {msg.user.current_firstname}")
-            history.append(f"Last Name: {msg.user.current_lastname}")
-            history.append(f"Message: {msg.message_text}")
-            history.append(f"Response: {msg.response_text}")
-            history.append("\n" + "="*50 + "\n")
-        
-        return "\n".join(history)
+    def parse_export_args(self, args):
+        """/export arguments -> export_rows filters. Raises ValueError."""
+        filters = {}
+        for arg in args:
+            key, sep, value = arg.partition('=')
+            if not sep or not value:
+                raise ValueError(f"Expected key=value, got '{arg}'")
+            if key == 'from':
+                filters['start'] = parse_bound(value)
+            elif key == 'to':
+                filters['end'] = parse_bound(value, end=True)
+            elif key == 'chat':
+                filters['chat_id'] = value
+            elif key == 'user':
+                filters['user_id'] = value
+            else:
+                raise ValueError(f"Unknown filter '{key}'")
+        return filters
 
-    async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        if not update.message.document:
-            return
-        
-        temp_file = None
-        output_file = None
+    async def send_export(self, update: Update, context: ContextTypes.DEFAULT_TYPE, filename, **filters):
+        """Write an export to a temp file off the event loop and send it.
+
+        Returns the number of messages exported.
+        """
+        output_file = tempfile.NamedTemporaryFile(delete=False, suffix='.txt')
+        output_file.close()
         try:
-            # Get file from Telegram
-            file = await context.bot.get_file(update.message.document.file_id)
-            
-            # Download to temporary file
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.txt')
-            await file.download_to_drive(temp_file.name)
-            temp_file.close()  # Close the file explicitly
-            
-            # If this is a history file being uploaded for processing
-            if update.message.document.file_name == "temp_history.txt":
-                await self.process_history_file(update, context)
-                os.unlink(temp_file.name)
-                return
-                
-            # Otherwise, create new history file with translations
-            messages = self.db.query(Message).order_by(Message.timestamp.desc()).limit(100).all()
-            history_text = self.create_history_file(messages)
+            def write():
+                with self.SessionLocal() as db:
+                    return write_export(db, output_file.name, **filters)
             
-            # Write to new file
-            output_file = tempfile.NamedTemporaryFile(mode='w', delete=False, suffix='.txt', encoding='utf-8')
-            output_file.write(history_text)
-            output_file.close()  # Close the file explicitly
+            count = await asyncio.to_thread(write)
+            if not count:
+                await update.message.reply_text("No messages match.")
+                return 0
             
-            # Send file using a context manager
             with open(output_file.name, 'rb') as f:
                 await context.bot.send_document(
                     chat_id=update.effective_chat.id,
                     document=f,
-                    filename='chat_history_with_translations.txt'
+                    filename=filename
                 )
-            
-            # Clean up
-            if temp_file and os.path.exists(temp_file.name):
-                os.unlink(temp_file.name)
-            if output_file and os.path.exists(output_file.name):
-                os.unlink(output_file.name)
+            self.logger.info(f"Exported {count} messages to {filename}")
+            return count
+        finally:
+            os.unlink(output_file.name)
+
+    async def export(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/export [from=YYYY-MM-DD] [to=YYYY-MM-DD] [chat=<chat id>] [user=<user id>]"""
+        try:
+            filters = self.parse_export_args(context.args or [])
+        except ValueError as e:
+            await update.message.reply_text(
+                f"{str(e)}\nUsage: /export [from=YYYY-MM-DD] [to=YYYY-MM-DD] [chat=<chat id>] [user=<user id>]"
+            )
+            return
+        
+        try:
+            await self.send_export(update, context, 'temp_history.txt', **filters)
+        except Exception as e:
+            self.logger.error(f"Error exporting history: {str(e)}")
+            await update.message.reply_text(f"Error exporting history: {str(e)}")
+
+    async def handle_document(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not update.message.document:
+            return
+        
+        # If this is a history file being uploaded for processing; it downloads the file itself
+        if update.message.document.file_name == "temp_history.txt":
+            await self.process_history_file(update, context)
+            return
+        
+        stats = ImportStats(profile='')
+        try:
+            # Otherwise, send back the latest messages with translations; the
+            # document's content is not used, so it is not downloaded
+            with stats.stage('export'):
+                count = await self.send_export(update, context, 'chat_history_with_translations.txt',
+                                               limit=100, newest_first=True)
+            stats.set('exported_messages', count)
+            self.log_import_summary(stats, 'Export')
             
         except Exception as e:
             self.logger.error(f"Error handling document: {str(e)}")
             await update.message.reply_text(f"Error processing file: {str(e)}")
-        
-        finally:
-            # Additional cleanup in case of errors
-            try:
-                if temp_file and os.path.exists(temp_file.name):
-                    os.unlink(temp_file.name)
-                if output_file and os.path.exists(output_file.name):
-                    os.unlink(output_file.name)
-            except Exception as e:
-                self.logger.error(f"Error in cleanup: {str(e)}")
+
+def setup_logging():
+    # Supervisor collects stderr; the handler writes it on a listener thread
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter('[%(asctime)s] %(levelname)s in %(module)s: %(message)s'))
+    start_queue_logging(logging.getLogger(), [handler])
+    # One INFO line per getUpdates poll otherwise
+    logging.getLogger('httpx').setLevel(logging.WARNING)
 
 def main():
-    # Initialize database and create session
+    setup_logging()
+    
+    # Initialize database; handlers check out sessions from its pool
     engine, SessionLocal = init_database()
-    db_session = SessionLocal()
     
-    # Create bot with database session
-    bot = Bot(db_session=db_session)
+    # Create bot with the session factory
+    bot = Bot(session_factory=SessionLocal)
     application = Application.builder().token(TELEGRAM_TOKEN).build()
     
     # Add handlers
     application.add_handler(CommandHandler("start", bot.start))
-    application.add_handler(MessageHandler(filters.Document.ALL, bot.handle_document))
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_reply))
+    application.add_handler(CommandHandler("export", bot.export, block=False))
+    # Non-blocking so /start and other chats are answered during an import
+    application.add_handler(MessageHandler(filters.Document.ALL, bot.handle_document, block=False))
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, bot.handle_reply, block=False))
     
     application.run_polling()
 
@@ -0,0 +1,126 @@
+"""Rendered dashboard fragments shared by all app workers.
+
+Entries live in a small SQLite file in the app's private instance folder,
+so every gunicorn worker sees what any other worker rendered. The bot
+bumps a generation number after each committed import; entries from an
+older generation are never served, so the cache only has to be correct
+between imports.
+"""
+
+from contextlib import closing, contextmanager
+import os
+import sqlite3
+import time
+import logging
+
+# Flask's default instance folder for app.py, so the bot and the app share it
+CACHE_PATH = os.environ.get(
+    'DASHBOARD_CACHE_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'instance', 'dashboard_cache.sqlite')
+)
+# Total size of cached fragments before the least recently used are evicted; 0 disables the cache
+CACHE_MAX_BYTES = int(os.environ.get('DASHBOARD_CACHE_MAX_BYTES', 64 * 1024 * 1024))
+# Moving windows ('3days', '7days') slide even without imports
+CACHE_TTL = float(os.environ.get('DASHBOARD_CACHE_TTL', 300))
+
+logger = logging.getLogger(__name__)
+
+
+class DashboardCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        # Cached pages hold chat contents: keep them readable by this user only
+        os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+        os.close(os.open(path, os.O_RDWR | os.O_CREAT, 0o600))
+        with self._connect() as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL)')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS entries ('
+                'key TEXT PRIMARY KEY, generation INTEGER NOT NULL, created REAL NOT NULL, '
+                'accessed REAL NOT NULL, size INTEGER NOT NULL, value TEXT NOT NULL)'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS ix_entries_accessed ON entries (accessed)')
+
+    @contextmanager
+    def _connect(self):
+        # Commit (or roll back) the block's changes, then close the connection
+        with closing(sqlite3.connect(self.path, timeout=5)) as conn, conn:
+            yield conn
+
+    def _generation(self, conn):
+        row = conn.execute("SELECT value FROM meta WHERE name = 'generation'").fetchone()
+        return row[0] if row else 0
+
+    def generation(self):
+        if not self.enabled:
+            return 0
+        with self._connect() as conn:
+            return self._generation(conn)
+
+    def bump_generation(self):
+        """Invalidate every entry. Called by the bot after an import commits."""
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO meta (name, value) VALUES ('generation', 1) "
+                "ON CONFLICT (name) DO UPDATE SET value = value + 1"
+            )
+            conn.execute('DELETE FROM entries')
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                'SELECT value, generation, created FROM entries WHERE key = ?', (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, generation, created = row
+            if generation != self._generation(conn) or now - created > self.ttl:
+                conn.execute('DELETE FROM entries WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE entries SET accessed = ? WHERE key = ?', (now, key))
+            return value
+
+    def set(self, key, value, generation):
+        """Store `value` if `generation` is still current.
+
+        Pass the generation read before the data was queried, so a result
+        that raced with an import is not cached under the new generation.
+        """
+        if not self.enabled:
+            return
+        now = time.time()
+        size = len(value.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._connect() as conn:
+            if generation != self._generation(conn):
+                return
+            conn.execute(
+                'INSERT OR REPLACE INTO entries (key, generation, created, accessed, size, value) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (key, generation, now, now, size, value)
+            )
+            total = conn.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+            if total > self.max_bytes:
+                self._evict(conn, total - self.max_bytes)
+
+    def _evict(self, conn, excess):
+        freed = 0
+        doomed = []
+        for key, size in conn.execute('SELECT key, size FROM entries ORDER BY accessed'):
+            doomed.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        conn.executemany('DELETE FROM entries WHERE key = ?', doomed)
+        logger.info(f"Evicted {len(doomed)} dashboard cache entries ({freed} bytes)")
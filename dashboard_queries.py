@@ -0,0 +1,366 @@
+"""Read queries behind the dashboard.
+
+Everything here selects only the columns a view shows and returns plain
+named tuples, never ORM entities, so nothing is added to the session's
+identity map and templates get ready-to-print values. Timestamps are
+stored as naive UTC and converted to IST strings here, once per row.
+"""
+
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import chain, groupby
+from operator import attrgetter
+from sqlalchemy import or_, and_, select, union_all
+from sqlalchemy.sql import func
+from models import User, UserNameChange, Chat, Message, DailyActivity
+
+IST_OFFSET = timedelta(hours=5, minutes=30)
+
+GROUP_CHAT_TYPES = ['supergroup', 'group']
+
+# Rows fetched per round trip when streaming a whole window
+STREAM_BATCH_SIZE = 1000
+
+UserRecord = namedtuple('UserRecord', 'id user_id current_username current_firstname current_lastname name_changes')
+NameChangeRecord = namedtuple('NameChangeRecord', 'old_username old_firstname old_lastname')
+ChatRecord = namedtuple('ChatRecord', 'id chat_id chat_type chat_name')
+TotalRecord = namedtuple('TotalRecord', 'user_id current_username current_firstname current_lastname name_changes message_count')
+
+
+def format_ist(timestamp):
+    """Naive UTC timestamp -> display string in IST."""
+    return (timestamp + IST_OFFSET).strftime('%Y-%m-%d %I:%M:%S %p IST')
+
+
+def paginate_keyset(query, column, page_size, after=None, before=None):
+    """Fetch one page of `query` ordered by the unique `column`.
+
+    Pages are addressed by the `after`/`before` value of `column` on the
+    neighbouring page, so the cost of a page does not grow with how far
+    into the list it is. Returns (rows, prev_cursor, next_cursor).
+    """
+    if before is not None:
+        query = query.filter(column < before).order_by(column.desc())
+    else:
+        if after is not None:
+            query = query.filter(column > after)
+        query = query.order_by(column)
+
+    rows = query.limit(page_size + 1).all()
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if before is not None:
+        rows.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = after is not None, has_more
+
+    if not rows:
+        return rows, None, None
+    prev_cursor = getattr(rows[0], column.key) if has_prev else None
+    next_cursor = getattr(rows[-1], column.key) if has_next else None
+    return rows, prev_cursor, next_cursor
+
+
+def fetch_name_changes(db, user_pks):
+    """{users.id: [NameChangeRecord, ...]} for the given users, in one query.
+
+    `user_pks` is a collection of users.id or a subquery selecting them.
+    """
+    changes = {}
+    if isinstance(user_pks, (list, set, tuple)) and not user_pks:
+        return changes
+    rows = (db.query(UserNameChange.user_id, UserNameChange.old_username,
+                     UserNameChange.old_firstname, UserNameChange.old_lastname)
+            .filter(UserNameChange.user_id.in_(user_pks))
+            .order_by(UserNameChange.id))
+    for row in rows:
+        changes.setdefault(row.user_id, []).append(
+            NameChangeRecord(row.old_username, row.old_firstname, row.old_lastname)
+        )
+    return changes
+
+
+def fetch_users_page(db, cutoff_date, page_size, after=None, before=None):
+    """One page of users with private messages since the cutoff.
+
+    Returns ([UserRecord, ...], prev_cursor, next_cursor).
+    """
+    has_messages = (db.query(Message.id)
+                    .join(Chat, Message.chat_id == Chat.id)
+                    .filter(Message.user_id == User.id)
+                    .filter(Chat.chat_type == 'private')
+                    .filter(Message.timestamp >= cutoff_date)
+                    .exists())
+    rows, prev_cursor, next_cursor = paginate_keyset(
+        db.query(User.id, User.user_id, User.current_username,
+                 User.current_firstname, User.current_lastname)
+          .filter(has_messages),
+        User.user_id, page_size, after, before
+    )
+    changes = fetch_name_changes(db, [row.id for row in rows])
+    users = [UserRecord(*row, changes.get(row.id, [])) for row in rows]
+    return users, prev_cursor, next_cursor
+
+
+def fetch_groups_page(db, cutoff_date, page_size, after=None, before=None):
+    """One page of group chats with messages since the cutoff.
+
+    Returns ([ChatRecord, ...], prev_cursor, next_cursor).
+    """
+    has_messages = (db.query(Message.id)
+                    .filter(Message.chat_id == Chat.id)
+                    .filter(Message.timestamp >= cutoff_date)
+                    .exists())
+    rows, prev_cursor, next_cursor = paginate_keyset(
+        db.query(Chat.id, Chat.chat_id, Chat.chat_type, Chat.chat_name)
+          .filter(Chat.chat_type.in_(GROUP_CHAT_TYPES))
+          .filter(has_messages),
+        Chat.chat_id, page_size, after, before
+    )
+    return [ChatRecord(*row) for row in rows], prev_cursor, next_cursor
+
+
+def split_cutoff(cutoff_date):
+    """(first whole day after the cutoff, end of the cutoff's partial day or None).
+
+    A cutoff at midnight starts a whole day, so there is no partial day.
+    """
+    midnight = cutoff_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    if cutoff_date == midnight:
+        return cutoff_date.date(), None
+    next_midnight = midnight + timedelta(days=1)
+    return next_midnight.date(), next_midnight
+
+
+def activity_counts(cutoff_date, by, private_only=False, pks=None):
+    """Subquery of (pk, message_count) rows for messages since the exact cutoff.
+
+    Whole days come from the DailyActivity rollup; the rest of the cutoff's
+    own day is counted from messages, so the sum matches what the message
+    lists show. `by` is 'user_id' or 'chat_id'. A pk can have several rows;
+    callers sum them.
+    """
+    first_day, partial_end = split_cutoff(cutoff_date)
+    parts = [select(getattr(DailyActivity, by).label('pk'), DailyActivity.message_count)
+             .where(DailyActivity.day >= first_day)]
+    if partial_end is not None:
+        key = getattr(Message, by)
+        parts.append(select(key.label('pk'), func.count(Message.id).label('message_count'))
+                     .where(Message.timestamp >= cutoff_date, Message.timestamp < partial_end)
+                     .group_by(key))
+
+    for i, (part, table) in enumerate(zip(parts, [DailyActivity, Message])):
+        if private_only:
+            part = part.join(Chat, table.chat_id == Chat.id).where(Chat.chat_type == 'private')
+        if pks is not None:
+            part = part.where(getattr(table, by).in_(pks))
+        parts[i] = part
+    return (union_all(*parts) if len(parts) > 1 else parts[0]).subquery()
+
+
+def fetch_totals(db, cutoff_date):
+    """Message count per user since the cutoff.
+
+    Whole days are read from the daily rollup, so cost follows users x
+    days plus the messages of the cutoff's partial day. Returns
+    [TotalRecord, ...].
+    """
+    counts = activity_counts(cutoff_date, 'user_id')
+    rows = (db.query(User.id, User.user_id, User.current_username,
+                     User.current_firstname, User.current_lastname,
+                     func.sum(counts.c.message_count).label('message_count'))
+            .join(counts, User.id == counts.c.pk)
+            .group_by(User.id, User.user_id, User.current_username,
+                      User.current_firstname, User.current_lastname)
+            .order_by(User.user_id)
+            .all())
+    changes = fetch_name_changes(db, [row.id for row in rows])
+    return [TotalRecord(row.user_id, row.current_username, row.current_firstname,
+                        row.current_lastname, changes.get(row.id, []), row.message_count)
+            for row in rows]
+
+
+def fetch_message_counts(db, kind, conversation_pks, cutoff_date):
+    """Messages per conversation since the cutoff; see activity_counts.
+
+    `kind` is 'user' (private chats, keyed by users.id) or 'group' (keyed
+    by chats.id). Pass None as conversation_pks to count every
+    conversation. Returns {pk: count}.
+    """
+    if conversation_pks is not None and not conversation_pks:
+        return {}
+
+    counts = activity_counts(cutoff_date, 'user_id' if kind == 'user' else 'chat_id',
+                             private_only=kind == 'user', pks=conversation_pks)
+    return dict(db.query(counts.c.pk, func.sum(counts.c.message_count))
+                .group_by(counts.c.pk).all())
+
+
+def previous_names(changes):
+    """[NameChangeRecord, ...] -> the previous_names list of a message record."""
+    return [{'firstname': change.old_firstname,
+             'lastname': change.old_lastname,
+             'username': change.old_username}
+            for change in changes]
+
+
+def message_record(row, previous_names=None):
+    message = {
+        'message_text': row.message_text,
+        'response_text': row.response_text,
+        'timestamp': format_ist(row.timestamp),
+        'user': {
+            'user_id': row.user_id,
+            'username': row.current_username,
+            'firstname': row.current_firstname,
+            'lastname': row.current_lastname,
+        },
+    }
+    if previous_names is not None:
+        message['user']['previous_names'] = previous_names
+    return message
+
+
+def fetch_previews(db, kind, conversation_pks, cutoff_date, limit):
+    """Latest `limit` messages of each conversation.
+
+    Computed in the database in one query with a ROW_NUMBER() window
+    function partitioned by conversation, so a busy group costs the same
+    as a quiet one. `kind` is 'user' (private chats, keyed by users.id) or
+    'group' (keyed by chats.id). Returns {pk: [message, ...]}.
+    """
+    if not conversation_pks:
+        return {}
+
+    partition = Message.user_id if kind == 'user' else Message.chat_id
+    ranked = (db.query(Message.id, Message.message_text, Message.response_text, Message.timestamp,
+                       Message.user_id.label('sender_pk'),
+                       partition.label('conversation_pk'),
+                       func.row_number().over(
+                           partition_by=partition,
+                           order_by=(Message.timestamp.desc(), Message.id.desc())
+                       ).label('position'))
+              .join(Chat, Message.chat_id == Chat.id)
+              .filter(partition.in_(conversation_pks))
+              .filter(Message.timestamp >= cutoff_date))
+    if kind == 'user':
+        ranked = ranked.filter(Chat.chat_type == 'private')
+    ranked = ranked.subquery()
+
+    rows = (db.query(ranked, User.user_id, User.current_username,
+                     User.current_firstname, User.current_lastname)
+            .join(User, ranked.c.sender_pk == User.id)
+            .filter(ranked.c.position <= limit)
+            .order_by(ranked.c.conversation_pk, ranked.c.position)
+            .all())
+
+    # Group previews show each sender's previous names, like the full view
+    changes = fetch_name_changes(db, {row.sender_pk for row in rows}) if kind == 'group' else {}
+    previews = {}
+    for row in rows:
+        names = previous_names(changes.get(row.sender_pk, [])) if kind == 'group' else None
+        previews.setdefault(row.conversation_pk, []).append(message_record(row, names))
+    return previews
+
+
+def parse_message_cursor(cursor):
+    """'<iso timestamp>_<id>' -> (datetime, int). Raises ValueError."""
+    cursor_time, cursor_id = cursor.rsplit('_', 1)
+    return datetime.fromisoformat(cursor_time), int(cursor_id)
+
+
+def fetch_conversation_messages(db, kind, conversation_id, cutoff_date, limit, cursor=None):
+    """One page of a conversation's messages, newest first.
+
+    Keyset-paged on (timestamp, id); `cursor` is the next_cursor of the
+    previous page. Group messages carry their sender's previous names.
+    Returns ([message, ...], next_cursor). Raises ValueError for an
+    unknown kind or a malformed cursor.
+    """
+    query = (db.query(Message.id, Message.message_text, Message.response_text, Message.timestamp,
+                      User.id.label('user_pk'), User.user_id, User.current_username,
+                      User.current_firstname, User.current_lastname)
+             .select_from(Message)
+             .join(Chat, Message.chat_id == Chat.id)
+             .join(User, Message.user_id == User.id)
+             .filter(Message.timestamp >= cutoff_date))
+    if kind == 'user':
+        query = query.filter(User.user_id == conversation_id).filter(Chat.chat_type == 'private')
+    elif kind == 'group':
+        query = query.filter(Chat.chat_id == conversation_id)
+    else:
+        raise ValueError(f"Unknown conversation kind: {kind}")
+
+    if cursor:
+        cursor_time, cursor_id = parse_message_cursor(cursor)
+        query = query.filter(or_(
+            Message.timestamp < cursor_time,
+            and_(Message.timestamp == cursor_time, Message.id < cursor_id)
+        ))
+
+    rows = query.order_by(Message.timestamp.desc(), Message.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = f"{rows[-1].timestamp.isoformat()}_{rows[-1].id}"
+
+    if kind == 'user':
+        messages = [message_record(row) for row in rows]
+        for message in messages:
+            del message['user']
+        return messages, next_cursor
+
+    changes = fetch_name_changes(db, {row.user_pk for row in rows})
+    messages = [message_record(row, previous_names(changes.get(row.user_pk, []))) for row in rows]
+    return messages, next_cursor
+
+
+def stream_conversations(db, kind, cutoff_date, batch_size=STREAM_BATCH_SIZE):
+    """Every conversation with messages since the cutoff, with its messages.
+
+    The messages come from a single query read `batch_size` rows at a time
+    (a server-side cursor on PostgreSQL), ordered by conversation so
+    consecutive rows are grouped as they arrive. Yields one dict per
+    conversation shaped like the paged views' items, except that
+    'messages' is itself a generator: only one batch of rows is held in
+    memory however large the window is. Conversations come in the order
+    they were first stored, which the (conversation, timestamp) indexes
+    can return without sorting the whole window first.
+    """
+    partition = Message.user_id if kind == 'user' else Message.chat_id
+    query = (db.query(Message.id, Message.message_text, Message.response_text, Message.timestamp,
+                      partition.label('conversation_pk'),
+                      User.id.label('user_pk'), User.user_id, User.current_username,
+                      User.current_firstname, User.current_lastname,
+                      Chat.chat_id, Chat.chat_type, Chat.chat_name)
+             .select_from(Message)
+             .join(Chat, Message.chat_id == Chat.id)
+             .join(User, Message.user_id == User.id)
+             .filter(Message.timestamp >= cutoff_date))
+    if kind == 'user':
+        query = query.filter(Chat.chat_type == 'private')
+    else:
+        query = query.filter(Chat.chat_type.in_(GROUP_CHAT_TYPES))
+
+    # The small per-conversation lookups are read before the stream starts
+    counts = fetch_message_counts(db, kind, None, cutoff_date)
+    # Conversation owners for 'user', every sender for 'group'
+    changes = fetch_name_changes(db, query.with_entities(Message.user_id).distinct().scalar_subquery())
+
+    rows = (query.order_by(partition, Message.timestamp.desc(), Message.id.desc())
+            .yield_per(batch_size))
+    for conversation_pk, group in groupby(rows, key=attrgetter('conversation_pk')):
+        first = next(group)
+        if kind == 'user':
+            messages = (message_record(row) for row in chain([first], group))
+            user = UserRecord(first.user_pk, first.user_id, first.current_username,
+                              first.current_firstname, first.current_lastname,
+                              changes.get(first.user_pk, []))
+            yield {'user': user, 'message_count': counts.get(conversation_pk, 0), 'messages': messages}
+        else:
+            # Group messages carry their sender's previous names, as in the paged view
+            messages = (message_record(row, previous_names(changes.get(row.user_pk, [])))
+                        for row in chain([first], group))
+            chat = ChatRecord(conversation_pk, first.chat_id, first.chat_type, first.chat_name)
+            yield {'chat': chat, 'message_count': counts.get(conversation_pk, 0), 'messages': messages}
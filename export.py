@@ -0,0 +1,77 @@
+"""Export stored messages in the temp_history.txt format."""
+
+from datetime import datetime, timedelta
+from models import User, Chat, Message
+from history import iter_history
+
+# Rows fetched per round trip; on PostgreSQL this is a server-side cursor
+EXPORT_BATCH_SIZE = 1000
+
+
+def parse_bound(value, end=False):
+    """'YYYY-MM-DD' or an ISO timestamp -> datetime, or None if empty.
+
+    A bare date used as the end of a range covers that whole day.
+    Raises ValueError for anything else.
+    """
+    if not value:
+        return None
+    bound = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        bound += timedelta(days=1)
+    return bound
+
+
+def export_rows(db, start=None, end=None, chat_id=None, user_id=None,
+                limit=None, newest_first=False, batch_size=EXPORT_BATCH_SIZE):
+    """Yield format_entry() tuples for the matching messages.
+
+    `start` is inclusive and `end` exclusive; `chat_id` and `user_id` are
+    Telegram ids. Chat and user columns come from the same query as the
+    message, so there is no per-row round trip, and rows are read
+    `batch_size` at a time so memory does not grow with the export.
+    """
+    query = (db.query(Message.timestamp, Chat.chat_id, Chat.chat_type, Chat.chat_name,
+                      User.user_id, User.current_username, User.current_firstname,
+                      User.current_lastname, Message.message_text, Message.response_text)
+             .select_from(Message)
+             .join(Chat, Message.chat_id == Chat.id)
+             .join(User, Message.user_id == User.id))
+    if start is not None:
+        query = query.filter(Message.timestamp >= start)
+    if end is not None:
+        query = query.filter(Message.timestamp < end)
+    if chat_id is not None:
+        query = query.filter(Chat.chat_id == chat_id)
+    if user_id is not None:
+        query = query.filter(User.user_id == user_id)
+
+    if newest_first:
+        query = query.order_by(Message.timestamp.desc(), Message.id.desc())
+    else:
+        query = query.order_by(Message.timestamp, Message.id)
+    if limit is not None:
+        query = query.limit(limit)
+
+    for row in query.yield_per(batch_size):
+        yield tuple(row)
+
+
+def iter_export(db, **filters):
+    """Yield the export as text chunks; see export_rows for the filters."""
+    return iter_history(export_rows(db, **filters))
+
+
+def write_export(db, path, **filters):
+    """Write the export to `path`. Returns the number of messages written."""
+    count = 0
+
+    def counted():
+        nonlocal count
+        for row in export_rows(db, **filters):
+            count += 1
+            yield row
+
+    with open(path, 'w', encoding='utf-8') as f:
+        f.writelines(iter_history(counted()))
+    return count
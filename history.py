@@ -0,0 +1,145 @@
+"""Reading and writing of the temp_history.txt chat export format."""
+
+HEADER = "ℹ️ Chat History:"
+SEPARATOR = "=" * 50
+# Bytes decoded at a time by iter_lines
+LINE_CHUNK_SIZE = 1024 * 1024
+
+# Keys written by Bot.create_history_file, in file order
+FIELDS = [
+    'Time', 'Chat ID', 'Chat Type', 'Chat Name', 'User ID', 'Username',
+    'First Name', 'Last Name', 'Message', 'Response',
+]
+
+
+def parse_history(lines):
+    """Yield (entry_num, chat_info) for every entry in a history export.
+
+    `lines` is any iterable of text lines, typically an open file or
+    iter_lines() over a buffer, so only the entry currently being assembled
+    is held in memory. Entries are
+    delimited by SEPARATOR lines. A line starting with a known field key
+    starts that field; any other line continues the previous field, which
+    keeps multi-line Message/Response values intact. If the HEADER appears,
+    everything before it is discarded.
+    """
+    entry_num = 0
+    chat_info = {}
+    last_key = None
+
+    for line in lines:
+        line = line.rstrip('\r\n')
+
+        if HEADER in line:
+            # Drop anything before the header, as the old parser did
+            chat_info = {}
+            last_key = None
+            line = line.split(HEADER, 1)[1]
+            if not line.strip():
+                continue
+
+        if line.strip() == SEPARATOR:
+            if chat_info:
+                entry_num += 1
+                yield entry_num, _finish_entry(chat_info)
+                chat_info = {}
+            last_key = None
+            continue
+
+        key, sep, value = line.partition(': ')
+        key = key.strip()
+        if not sep and line.rstrip().endswith(':'):
+            # "Message:" with the trailing space stripped by an editor
+            key, sep, value = line.rstrip()[:-1].strip(), ':', ''
+
+        if sep and (key in FIELDS or last_key is None):
+            chat_info[key] = [value]
+            last_key = key
+        elif last_key is not None:
+            chat_info[last_key].append(line)
+
+    if chat_info:
+        entry_num += 1
+        yield entry_num, _finish_entry(chat_info)
+
+
+def iter_lines(buffer, chunk_size=LINE_CHUNK_SIZE):
+    """Yield the text lines of a UTF-8 buffer (bytes, bytearray or mmap).
+
+    The buffer is decoded a chunk of whole lines at a time, straight from
+    memoryview slices, so it is never copied as a whole and at most one
+    chunk exists as text. Line endings are dropped.
+    """
+    with memoryview(buffer) as view:
+        start, end = 0, len(view)
+        while start < end:
+            stop = min(start + chunk_size, end)
+            if stop < end:
+                # Cut after the chunk's last newline, or at the end of an overlong line
+                newline = buffer.rfind(b'\n', start, stop)
+                if newline == -1:
+                    newline = buffer.find(b'\n', stop)
+                stop = end if newline == -1 else newline + 1
+            lines = str(view[start:stop], 'utf-8').split('\n')
+            if not lines[-1]:
+                lines.pop()
+            yield from lines
+            start = stop
+
+
+def _finish_entry(chat_info):
+    """Join continuation lines and normalise empty values to None."""
+    entry = {}
+    for key, parts in chat_info.items():
+        value = '\n'.join(parts).strip()
+        entry[key] = value if value else None
+    return entry
+
+
+def format_entry(timestamp, chat_id, chat_type, chat_name, user_id, username,
+                 firstname, lastname, message_text, response_text):
+    """One entry in the export format, ending with its SEPARATOR line.
+
+    Values are written as stored (usernames keep their '@') and None as an
+    empty value, so parse_history() reads back what was exported.
+    """
+    lines = [
+        f"Time: {timestamp}",
+        f"Chat ID: {chat_id}",
+        f"Chat Type: {chat_type}",
+    ]
+    if chat_name:
+        lines.append(f"Chat Name: {chat_name}")
+    lines += [
+        f"User ID: {user_id}",
+        f"Username: {_text(username)}",
+        f"First Name: {_text(firstname)}",
+        f"Last Name: {_text(lastname)}",
+        f"Message: {_text(message_text)}",
+        f"Response: {_text(response_text)}",
+        "\n" + SEPARATOR + "\n",
+    ]
+    return "\n".join(lines)
+
+
+def _text(value):
+    return '' if value is None else value
+
+
+def iter_history(entries, entries_per_chunk=200):
+    """Yield an export of `entries` as text chunks.
+
+    `entries` is an iterable of format_entry() argument tuples. Chunks
+    hold `entries_per_chunk` entries, so a file or HTTP response can be
+    written as it is produced without building the whole export.
+    """
+    chunk = []
+    lead = ""
+    for entry in entries:
+        chunk.append(format_entry(*entry))
+        if len(chunk) >= entries_per_chunk:
+            yield lead + "\n".join(chunk)
+            chunk = []
+            lead = "\n"
+    if chunk:
+        yield lead + "\n".join(chunk)
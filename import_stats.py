@@ -0,0 +1,148 @@
+"""Stage timings, counters and optional profiling for one import."""
+
+from contextlib import contextmanager
+from datetime import datetime
+import cProfile
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+import tracemalloc
+
+# 'cprofile', 'tracemalloc' or both, comma separated; empty to disable
+IMPORT_PROFILE = os.environ.get('IMPORT_PROFILE', '')
+IMPORT_PROFILE_DIR = os.environ.get('IMPORT_PROFILE_DIR', tempfile.gettempdir())
+
+# Stage names in pipeline order, for reports
+STAGES = [
+    'download', 'parse', 'hindi_detection', 'lookup', 'transliteration',
+    'save_transliterations', 'clear', 'apply_transliterations', 'insert', 'commit', 'export',
+]
+
+# cProfile and tracemalloc are process-wide: one profiled import at a time
+_profiling_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+class ImportStats:
+    """Where an import spends its time.
+
+    Stages accumulate wall time, so a stage interleaved with others (parsing
+    feeds every other step entry by entry) is timed with lap() on a running
+    clock instead of a context manager per entry.
+    """
+
+    def __init__(self, profile=IMPORT_PROFILE):
+        self.stages = {}
+        self.counters = {}
+        self.profile_modes = {mode.strip() for mode in profile.split(',') if mode.strip()}
+        self.profiler = cProfile.Profile() if 'cprofile' in self.profile_modes else None
+        self.profiled = False
+        # (current bytes, peak bytes, Snapshot) per profiled block
+        self.memory_snapshots = []
+
+    def lap(self, name, since):
+        """Add the time since `since` to stage `name`. Returns now."""
+        now = time.perf_counter()
+        self.stages[name] = self.stages.get(name, 0.0) + now - since
+        return now
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.lap(name, start)
+
+    def count(self, name, value=1):
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        self.counters[name] = value
+
+    @contextmanager
+    def profiling(self):
+        """Profile the enclosed work, in the thread that runs it, if enabled.
+
+        Skipped, with a log line, while another import is being profiled.
+        """
+        if not self.profile_modes:
+            yield
+            return
+        if not _profiling_lock.acquire(blocking=False):
+            logger.info("Another import is being profiled; not profiling this one")
+            yield
+            return
+
+        trace_memory = 'tracemalloc' in self.profile_modes and not tracemalloc.is_tracing()
+        try:
+            self.profiled = True
+            if trace_memory:
+                tracemalloc.start()
+            if self.profiler is not None:
+                self.profiler.enable()
+            yield
+        finally:
+            try:
+                if self.profiler is not None:
+                    self.profiler.disable()
+                if trace_memory:
+                    current, peak = tracemalloc.get_traced_memory()
+                    self.memory_snapshots.append((current, peak, tracemalloc.take_snapshot()))
+                    tracemalloc.stop()
+            finally:
+                _profiling_lock.release()
+
+    def write_profile(self):
+        """Write the captured profiles. Returns the paths written."""
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        paths = []
+        if self.profiler is not None and self.profiled:
+            path = os.path.join(IMPORT_PROFILE_DIR, f'import_{stamp}.prof')
+            self.profiler.dump_stats(path)
+            paths.append(path)
+        if self.memory_snapshots:
+            path = os.path.join(IMPORT_PROFILE_DIR, f'import_{stamp}.tracemalloc.txt')
+            with open(path, 'w') as f:
+                for number, (current, peak, snapshot) in enumerate(self.memory_snapshots, 1):
+                    f.write(f"pass {number}: current: {current} bytes, peak: {peak} bytes\n\n")
+                    for stat in snapshot.statistics('lineno')[:50]:
+                        f.write(f"{stat}\n")
+                    f.write("\n")
+            paths.append(path)
+        return paths
+
+    def total(self):
+        return sum(self.stages.values())
+
+    def summary(self):
+        ordered = sorted(self.stages, key=lambda name: STAGES.index(name) if name in STAGES else len(STAGES))
+        return {
+            'seconds': round(self.total(), 3),
+            'stages': {name: round(self.stages[name], 3) for name in ordered},
+            'counters': dict(self.counters),
+        }
+
+    def summary_json(self):
+        return json.dumps(self.summary(), sort_keys=False)
+
+    def report(self):
+        """Short human-readable timing lines for the chat reply."""
+        summary = self.summary()
+        stages = ', '.join(f"{name} {seconds:.1f}s" for name, seconds in summary['stages'].items()
+                           if seconds >= 0.05)
+        lines = [f"Time: {summary['seconds']:.1f}s" + (f" ({stages})" if stages else '')]
+        counters = summary['counters']
+        if counters.get('entries') and summary['seconds']:
+            lines.append(f"Throughput: {counters['entries'] / summary['seconds']:.0f} entries/s")
+        details = [f"{label}: {counters[key]}" for key, label in [
+            ('bytes', 'Bytes'), ('hindi_words', 'Hindi words'),
+            ('rows_written', 'Rows written'), ('commits', 'Commits'),
+        ] if key in counters]
+        if details:
+            lines.append(', '.join(details))
+        return '\n'.join(lines)
@@ -0,0 +1,315 @@
+"""Batched loading of parsed history entries into the database."""
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import User, UserNameChange, Chat, Message, DailyActivity
+from search import index_messages
+from collections import Counter
+from datetime import datetime
+import hashlib
+import logging
+
+REQUIRED_FIELDS = ['Chat ID', 'Chat Type', 'User ID', 'Username', 'First Name', 'Message', 'Response', 'Time']
+
+# Keeps IN (...) lists under SQLite's bound parameter limit
+LOOKUP_CHUNK_SIZE = 500
+
+
+def parse_timestamp(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S.%f')
+    except ValueError:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+
+
+def message_hash(chat_id, user_id, timestamp, message_text, response_text):
+    """Stable identity of a message: same source entry, same hash."""
+    parts = [chat_id, user_id, timestamp.isoformat(), message_text, response_text]
+    key = '\x1f'.join('' if part is None else str(part) for part in parts)
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def entry_hash(chat_info):
+    """message_hash for a parsed entry, or None if it cannot be identified."""
+    try:
+        timestamp = parse_timestamp(chat_info['Time'])
+        return message_hash(chat_info['Chat ID'], chat_info['User ID'], timestamp,
+                            chat_info['Message'], chat_info['Response'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def dialect_insert(db_session, table):
+    """INSERT that can take ON CONFLICT clauses where the backend supports it.
+
+    Returns None for backends without an upsert construct.
+    """
+    dialect = db_session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table)
+    if dialect == 'sqlite':
+        return sqlite.insert(table)
+    return None
+
+
+def chunked(items, size=LOOKUP_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class BulkLoader:
+    """Accumulate entries and write them in batches.
+
+    Chats and users are upserted once per batch and their primary keys are
+    kept in memory, so each message costs no extra round trip. Messages are
+    inserted with one executemany per batch. Messages whose message_hash is
+    already stored are skipped, so re-importing an export only writes what
+    is new; users and chats are only touched by new messages. New messages
+    are also added to the DailyActivity rollup and the search index. The
+    caller owns the transaction: call flush() when done, then commit the
+    session.
+    """
+
+    def __init__(self, db_session, batch_size=5000):
+        self.db = db_session
+        self.batch_size = batch_size
+        self.logger = logging.getLogger(__name__)
+
+        # chat_id -> chats.id
+        self.chat_ids = {}
+        # user_id -> (users.id, username, firstname, lastname)
+        self.users = {}
+
+        self.pending = []
+        self.valid_entries = 0
+        self.skipped_entries = 0
+        self.new_entries = 0
+        self.duplicate_entries = 0
+        self.rows_written = 0
+
+    def add(self, entry_num, chat_info, message_hash=None):
+        """Queue one parsed entry. Returns False if it was skipped.
+
+        Pass message_hash when chat_info has been rewritten (e.g.
+        transliterated) so identity is taken from the original entry.
+        """
+        missing = [k for k in REQUIRED_FIELDS if k not in chat_info]
+        if missing:
+            self.logger.warning(f"Entry {entry_num} missing fields: {missing}")
+            self.skipped_entries += 1
+            return False
+
+        try:
+            timestamp = parse_timestamp(chat_info['Time'])
+        except (TypeError, ValueError) as e:
+            self.logger.error(f"Error processing entry {entry_num}: {str(e)}")
+            self.skipped_entries += 1
+            return False
+
+        self.pending.append({
+            'chat_id': chat_info['Chat ID'],
+            'chat_type': chat_info['Chat Type'],
+            'chat_name': chat_info.get('Chat Name'),
+            'user_id': chat_info['User ID'],
+            'username': chat_info['Username'],
+            'firstname': chat_info['First Name'],
+            'lastname': chat_info.get('Last Name'),
+            'message_text': chat_info['Message'],
+            'response_text': chat_info['Response'],
+            'timestamp': timestamp,
+            'message_hash': message_hash or entry_hash(chat_info),
+        })
+        self.valid_entries += 1
+
+        if len(self.pending) >= self.batch_size:
+            self.flush()
+        return True
+
+    def flush(self):
+        if not self.pending:
+            return
+        batch, self.pending = self.pending, []
+
+        batch = self._drop_known_messages(batch)
+        if not batch:
+            return
+
+        self._upsert_chats(batch)
+        self._upsert_users(batch)
+
+        messages = [{
+            'chat_id': self.chat_ids[row['chat_id']],
+            'user_id': self.users[row['user_id']][0],
+            'message_text': row['message_text'],
+            'response_text': row['response_text'],
+            'timestamp': row['timestamp'],
+            'message_hash': row['message_hash'],
+        } for row in batch]
+        table = Message.__table__
+        stmt = dialect_insert(self.db, table)
+        if stmt is not None:
+            # A concurrent import may have stored some of these since
+            # _drop_known_messages; only the rows returned were inserted
+            stmt = (stmt.on_conflict_do_nothing(index_elements=['message_hash'])
+                    .returning(table.c.user_id, table.c.chat_id, table.c.timestamp, table.c.message_hash))
+            inserted = [row._asdict() for row in self.db.execute(stmt, messages)]
+            self.duplicate_entries += len(messages) - len(inserted)
+        else:
+            self.db.execute(insert(table), messages)
+            inserted = messages
+        if not inserted:
+            return
+        self.new_entries += len(inserted)
+        self.rows_written += len(inserted)
+        for chunk in chunked(message['message_hash'] for message in inserted):
+            index_messages(self.db, chunk)
+        self._add_daily_activity(inserted)
+        self.logger.info(f"Flushed batch of {len(inserted)} new messages")
+
+    def _add_daily_activity(self, messages):
+        """Add the batch's messages to the per (user, chat, day) rollup."""
+        counts = Counter(
+            (message['user_id'], message['chat_id'], message['timestamp'].date())
+            for message in messages
+        )
+        values = [{'user_id': user_pk, 'chat_id': chat_pk, 'day': day, 'message_count': count}
+                  for (user_pk, chat_pk, day), count in counts.items()]
+
+        table = DailyActivity.__table__
+        stmt = dialect_insert(self.db, table)
+        if stmt is not None:
+            self.db.execute(stmt.on_conflict_do_update(
+                index_elements=['user_id', 'chat_id', 'day'],
+                set_={'message_count': table.c.message_count + stmt.excluded.message_count},
+            ), values)
+        else:
+            for value in values:
+                result = self.db.execute(
+                    update(table)
+                    .where(table.c.user_id == value['user_id'])
+                    .where(table.c.chat_id == value['chat_id'])
+                    .where(table.c.day == value['day'])
+                    .values(message_count=table.c.message_count + value['message_count'])
+                )
+                if result.rowcount == 0:
+                    self.db.execute(insert(table), [value])
+        self.rows_written += len(values)
+
+    def _drop_known_messages(self, batch):
+        """Remove entries already stored, or repeated within the batch."""
+        known = set()
+        for chunk in chunked({row['message_hash'] for row in batch}):
+            rows = self.db.execute(select(Message.message_hash).where(Message.message_hash.in_(chunk)))
+            known.update(h for (h,) in rows)
+
+        fresh = []
+        for row in batch:
+            if row['message_hash'] in known:
+                self.duplicate_entries += 1
+                continue
+            known.add(row['message_hash'])
+            fresh.append(row)
+        return fresh
+
+    def _upsert_chats(self, batch):
+        new_chats = {}
+        for row in batch:
+            if row['chat_id'] not in self.chat_ids and row['chat_id'] not in new_chats:
+                new_chats[row['chat_id']] = {
+                    'chat_id': row['chat_id'],
+                    'chat_type': row['chat_type'],
+                    'chat_name': row['chat_name'],
+                }
+        if not new_chats:
+            return
+
+        # Existing chats keep their type and name, as before
+        self._load_chat_ids(new_chats)
+        missing = [values for chat_id, values in new_chats.items() if chat_id not in self.chat_ids]
+        if missing:
+            stmt = dialect_insert(self.db, Chat.__table__)
+            if stmt is not None:
+                stmt = stmt.on_conflict_do_nothing(index_elements=['chat_id'])
+            else:
+                stmt = insert(Chat.__table__)
+            self.db.execute(stmt, missing)
+            self.rows_written += len(missing)
+            self._load_chat_ids([values['chat_id'] for values in missing])
+
+    def _load_chat_ids(self, chat_ids):
+        for chunk in chunked(chat_ids):
+            rows = self.db.execute(select(Chat.id, Chat.chat_id).where(Chat.chat_id.in_(chunk)))
+            for pk, chat_id in rows:
+                self.chat_ids[chat_id] = pk
+
+    def _upsert_users(self, batch):
+        unknown = {row['user_id'] for row in batch if row['user_id'] not in self.users}
+        for chunk in chunked(unknown):
+            rows = self.db.execute(
+                select(User.id, User.user_id, User.current_username,
+                       User.current_firstname, User.current_lastname)
+                .where(User.user_id.in_(chunk))
+            )
+            for pk, user_id, username, firstname, lastname in rows:
+                self.users[user_id] = (pk, username, firstname, lastname)
+
+        # Replay the batch in order so every name change is recorded
+        changed = {}
+        name_changes = []
+        for row in batch:
+            names = (row['username'], row['firstname'], row['lastname'])
+            current = changed.get(row['user_id'], self.users.get(row['user_id']))
+            if current is None:
+                changed[row['user_id']] = (None,) + names
+            elif current[1:] != names:
+                name_changes.append((row['user_id'],) + current[1:])
+                changed[row['user_id']] = (current[0],) + names
+        if not changed:
+            return
+
+        values = [{
+            'user_id': user_id,
+            'current_username': state[1],
+            'current_firstname': state[2],
+            'current_lastname': state[3],
+        } for user_id, state in changed.items()]
+
+        stmt = dialect_insert(self.db, User.__table__)
+        if stmt is not None:
+            stmt = stmt.on_conflict_do_update(
+                index_elements=['user_id'],
+                set_={
+                    'current_username': stmt.excluded.current_username,
+                    'current_firstname': stmt.excluded.current_firstname,
+                    'current_lastname': stmt.excluded.current_lastname,
+                },
+            )
+            self.db.execute(stmt, values)
+        else:
+            new_users = [v for v in values if changed[v['user_id']][0] is None]
+            if new_users:
+                self.db.execute(insert(User.__table__), new_users)
+            for v in values:
+                if changed[v['user_id']][0] is not None:
+                    self.db.execute(
+                        update(User.__table__)
+                        .where(User.user_id == v['user_id'])
+                        .values(**{k: v[k] for k in v if k != 'user_id'})
+                    )
+        self.rows_written += len(values)
+
+        for chunk in chunked(changed):
+            rows = self.db.execute(select(User.id, User.user_id).where(User.user_id.in_(chunk)))
+            for pk, user_id in rows:
+                state = changed[user_id]
+                self.users[user_id] = (pk,) + state[1:]
+
+        if name_changes:
+            self.db.execute(insert(UserNameChange.__table__), [{
+                'user_id': self.users[user_id][0],
+                'old_username': username,
+                'old_firstname': firstname,
+                'old_lastname': lastname,
+            } for user_id, username, firstname, lastname in name_changes])
+            self.rows_written += len(name_changes)
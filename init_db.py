@@ -1,61 +1,237 @@
-from sqlalchemy import create_engine, text
+from sqlalchemy import create_engine, text, inspect, select, insert, update, delete, bindparam, func
+from sqlalchemy.engine import make_url
 from sqlalchemy.orm import sessionmaker
-from sqlalchemy.exc import OperationalError
+from sqlalchemy.exc import DBAPIError, OperationalError
 import os
+import logging
+import weakref
 from dotenv import load_dotenv
-from models import Base
+from models import Base, User, Chat, Message, DailyActivity, Meta
+from ingest import message_hash
+from search import ensure_search_index
+from pool_stats import InstrumentedQueuePool, install_pool_stats
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 
-def init_database():
+# Meta key set when hashes were backfilled: the next import must run in 'replace' mode
+REPLACE_ON_NEXT_IMPORT = 'replace_on_next_import'
+
+def upgrade_schema(engine):
+    """Bring an existing database up to date with models.py.
+
+    create_all only creates missing tables, so columns and indexes added
+    to existing tables are created here. Safe to run on every start.
+    """
+    inspector = inspect(engine)
+    columns = {column['name'] for column in inspector.get_columns('messages')}
+    
+    if 'message_hash' not in columns:
+        logger.info("Adding messages.message_hash")
+        with engine.begin() as conn:
+            conn.execute(text('ALTER TABLE messages ADD COLUMN message_hash VARCHAR(64)'))
+        backfill_message_hashes(engine)
+    
+    # Roll up messages imported before daily_activity existed
+    with engine.begin() as conn:
+        has_activity = conn.execute(select(DailyActivity.id).limit(1)).first()
+        has_messages = conn.execute(select(Message.id).limit(1)).first()
+        if has_messages and not has_activity:
+            logger.info("Backfilling daily_activity")
+            day = func.date(Message.timestamp)
+            conn.execute(
+                insert(DailyActivity.__table__).from_select(
+                    ['user_id', 'chat_id', 'day', 'message_count'],
+                    select(Message.user_id, Message.chat_id, day, func.count(Message.id))
+                    .group_by(Message.user_id, Message.chat_id, day)
+                )
+            )
+    
+    # Indexes declared in models.py that an older database lacks
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(engine, checkfirst=True)
+    
+    ensure_search_index(engine)
+
+def backfill_message_hashes(engine, batch_size=5000):
+    """Compute message_hash for rows imported before it existed.
+
+    Rows that hash identically to an earlier row are duplicates of the same
+    entry and are deleted, so the unique index can be created.
+    
+    Older imports stored transliterated text, so these hashes do not match
+    the raw entries of a new upload, and a merge would duplicate them. The
+    next import is therefore flagged to replace everything.
+    """
+    seen = set()
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                select(Message.id, Chat.chat_id, User.user_id, Message.timestamp,
+                       Message.message_text, Message.response_text)
+                .join(Chat, Message.chat_id == Chat.id)
+                .join(User, Message.user_id == User.id)
+                .where(Message.id > last_id)
+                .order_by(Message.id)
+                .limit(batch_size)
+            ).all()
+            if not rows:
+                break
+            
+            hashes = []
+            duplicates = []
+            for row in rows:
+                key = message_hash(row.chat_id, row.user_id, row.timestamp,
+                                   row.message_text, row.response_text)
+                if key in seen:
+                    duplicates.append(row.id)
+                else:
+                    seen.add(key)
+                    hashes.append({'row_id': row.id, 'hash': key})
+            
+            if hashes:
+                conn.execute(
+                    update(Message.__table__)
+                    .where(Message.__table__.c.id == bindparam('row_id'))
+                    .values(message_hash=bindparam('hash')),
+                    hashes
+                )
+            if duplicates:
+                conn.execute(delete(Message.__table__).where(Message.__table__.c.id.in_(duplicates)))
+            last_id = rows[-1].id
+    if seen:
+        with engine.begin() as conn:
+            conn.execute(delete(Meta.__table__).where(Meta.__table__.c.key == REPLACE_ON_NEXT_IMPORT))
+            conn.execute(insert(Meta.__table__).values(key=REPLACE_ON_NEXT_IMPORT, value='message_hash backfill'))
+    logger.info(f"Backfilled message_hash for {len(seen)} messages")
+
+def env_flag(name, default):
+    value = os.environ.get(name)
+    if value is None:
+        return default
+    return value.strip().lower() not in ('0', 'false', 'no', 'off', '')
+
+def get_database_url():
     DATABASE_URL = os.environ.get('DATABASE_URL')
     
     # Handle special case for Render PostgreSQL URL
     if DATABASE_URL and DATABASE_URL.startswith("postgres://"):
         DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql://", 1)
-    
+    return DATABASE_URL
+
+def engine_options(database_url):
+    """Pool settings for create_engine, from the environment.
+
+    DB_PRE_PING (default on) tests connections on checkout so a dropped
+    connection is replaced instead of failing the next request, and
+    DB_POOL_RECYCLE replaces connections older than that many seconds.
+    DB_POOL_SIZE, DB_MAX_OVERFLOW and DB_POOL_TIMEOUT apply to server
+    databases; SQLite picks its own pool.
+    """
+    options = {
+        'pool_pre_ping': env_flag('DB_PRE_PING', True),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    }
+    if database_url and not database_url.startswith('sqlite'):
+        options['poolclass'] = InstrumentedQueuePool
+        options['pool_size'] = int(os.environ.get('DB_POOL_SIZE', 5))
+        options['max_overflow'] = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+        options['pool_timeout'] = float(os.environ.get('DB_POOL_TIMEOUT', 30))
+    return options
+
+# Engines made by create_db_engine, disposed in forked children
+_engines = weakref.WeakSet()
+
+def _dispose_after_fork():
+    # The child must not use the parent's sockets; close=False leaves them
+    # open for the parent and gives the child a fresh, empty pool
+    for engine in list(_engines):
+        engine.dispose(close=False)
+        engine.pool_stats.reset()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_dispose_after_fork)
+
+def create_db_engine(database_url=None):
+    """The one place engines are created.
+
+    Pool settings come from engine_options(), pool statistics are
+    collected (see pool_stats.pool_status), and the pool is replaced in
+    any process forked from this one, e.g. gunicorn workers of a
+    preloaded app.
+    """
+    database_url = database_url or get_database_url()
+    engine = create_engine(database_url, **engine_options(database_url))
+    install_pool_stats(engine)
+    _engines.add(engine)
+    return engine
+
+# Arbitrary key for pg_advisory_lock, held while the schema is upgraded
+MIGRATION_LOCK_ID = 7305418
+
+def create_missing_database(database_url):
+    """Create the database named in a PostgreSQL URL."""
+    url = make_url(database_url)
+    db_name = url.database
+    temp_engine = create_engine(url.set(database='postgres'))
+    try:
+        with temp_engine.execution_options(isolation_level="AUTOCOMMIT").connect() as conn:
+            conn.execute(text(f'CREATE DATABASE "{db_name}"'))
+    except DBAPIError as e:
+        # Another migration run created it first
+        if "already exists" not in str(e):
+            raise
+    finally:
+        temp_engine.dispose()
+
+def migrate_database():
+    """Create missing tables and upgrade the schema. Run once per deploy.
+
+    `python init_db.py` runs this before the bot and the web workers start,
+    so they never race each other on DDL or backfills. On PostgreSQL an
+    advisory lock also serialises concurrent runs.
+    """
+    DATABASE_URL = get_database_url()
+    engine = create_db_engine(DATABASE_URL)
     try:
-        # Create engine
-        engine = create_engine(DATABASE_URL)
-        
-        # Create all tables
-        Base.metadata.create_all(engine)
-        
-        # Create sessionmaker
+        try:
+            lock = engine.connect()
+        except OperationalError as e:
+            if "database" in str(e) and "does not exist" in str(e):
+                create_missing_database(DATABASE_URL)
+                lock = engine.connect()
+            else:
+                raise
+        with lock:
+            if engine.dialect.name == 'postgresql':
+                lock.execute(text('SELECT pg_advisory_lock(:id)'), {'id': MIGRATION_LOCK_ID})
+            try:
+                Base.metadata.create_all(engine)
+                upgrade_schema(engine)
+            finally:
+                if engine.dialect.name == 'postgresql':
+                    lock.execute(text('SELECT pg_advisory_unlock(:id)'), {'id': MIGRATION_LOCK_ID})
+                    lock.commit()
+    finally:
+        engine.dispose()
+
+def init_database():
+    """Engine and session factory for the configured database.
+
+    Does not touch the schema; migrate_database() does that once per deploy.
+    """
+    DATABASE_URL = get_database_url()
+    try:
+        engine = create_db_engine(DATABASE_URL)
         SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-        
         return engine, SessionLocal
-        
     except Exception as e:
-        if "database" in str(e) and "does not exist" in str(e):
-            try:
-                # Extract database name and create default connection URL
-                db_name = DATABASE_URL.rsplit('/', 1)[1]
-                default_db_url = DATABASE_URL.rsplit('/', 1)[0] + '/postgres'
-                
-                # Connect to default postgres database
-                temp_engine = create_engine(default_db_url)
-                
-                # Create new connection with autocommit
-                conn = temp_engine.execution_options(isolation_level="AUTOCOMMIT").connect()
-                
-                # Create database if it doesn't exist
-                conn.execute(text(f'CREATE DATABASE "{db_name}"'))
-                conn.close()
-                temp_engine.dispose()
-                
-                # Try again with the new database
-                engine = create_engine(DATABASE_URL)
-                Base.metadata.create_all(engine)
-                SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-                
-                return engine, SessionLocal
-                
-            except Exception as inner_e:
-                raise Exception(f"Failed to create database. Original error: {str(e)}. Creation error: {str(inner_e)}") from inner_e
-        else:
-            raise Exception(f"Database connection failed: {str(e)}") from e
+        raise Exception(f"Database connection failed: {str(e)}") from e
 
 if __name__ == "__main__":
-    init_database() 
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO)
+    migrate_database()
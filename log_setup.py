@@ -0,0 +1,71 @@
+"""Queue-based logging, so handlers write on a listener thread, not the caller's."""
+
+from logging.handlers import QueueHandler, QueueListener
+import atexit
+import logging
+import os
+import queue
+
+# Per-entry diagnostics: the first LOG_SAMPLE_FIRST entries, then every LOG_SAMPLE_EVERY-th
+LOG_SAMPLE_FIRST = int(os.environ.get('LOG_SAMPLE_FIRST', 5))
+LOG_SAMPLE_EVERY = int(os.environ.get('LOG_SAMPLE_EVERY', 10000))
+
+_listeners = []
+
+
+def start_queue_logging(logger, handlers, level=logging.INFO):
+    """Replace `logger`'s handlers with a queue drained by `handlers` on a thread.
+
+    Records are only enqueued on the calling thread; formatting and I/O
+    happen in the listener. Returns the started QueueListener.
+    """
+    log_queue = queue.SimpleQueue()
+    handler = QueueHandler(log_queue)
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    logger.handlers = [handler]
+    logger.setLevel(level)
+    listener.start()
+    _listeners.append((handler, listener))
+    return listener
+
+
+def _stop_listeners():
+    # Flushes whatever is still queued
+    for _, listener in _listeners:
+        if listener._thread is not None:
+            listener.stop()
+
+
+def _restart_after_fork():
+    # The listener thread does not survive fork (e.g. gunicorn --preload);
+    # give the child a fresh queue too, in case the parent held its lock
+    for handler, listener in _listeners:
+        handler.queue = listener.queue = queue.SimpleQueue()
+        listener._thread = None
+        listener.start()
+
+
+atexit.register(_stop_listeners)
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_restart_after_fork)
+
+
+class LogSampler:
+    """Decides which items of a long run get a log line.
+
+    Call once per item; True for the first `first` items and every
+    `every`-th after that. Failures should be logged regardless.
+    """
+
+    def __init__(self, first=LOG_SAMPLE_FIRST, every=LOG_SAMPLE_EVERY):
+        self.first = first
+        self.every = every
+        self.seen = 0
+        self.suppressed = 0
+
+    def __call__(self):
+        self.seen += 1
+        if self.seen <= self.first or (self.every and self.seen % self.every == 0):
+            return True
+        self.suppressed += 1
+        return False
@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, Text, ForeignKey
+from sqlalchemy import create_engine, Column, Integer, String, DateTime, Date, Text, ForeignKey, Boolean, Index, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
 from datetime import datetime
@@ -30,7 +30,7 @@ class UserNameChange(Base):
     __tablename__ = 'user_name_changes'
     
     id = Column(Integer, primary_key=True)
-    user_id = Column(Integer, ForeignKey('users.id'))
+    user_id = Column(Integer, ForeignKey('users.id'), index=True)
     old_username = Column(String(100))
     old_firstname = Column(String(100))
     old_lastname = Column(String(100))
@@ -42,7 +42,7 @@ class Chat(Base):
     
     id = Column(Integer, primary_key=True)
     chat_id = Column(String(50), unique=True)
-    chat_type = Column(String(20))
+    chat_type = Column(String(20), index=True)
     chat_name = Column(String(255))
     messages = relationship("Message", back_populates="chat")
 
@@ -58,6 +58,12 @@ class Chat(Base):
 
 class Message(Base):
     __tablename__ = 'messages'
+    # Match the dashboard's access paths: time window alone, or joined by user/chat
+    __table_args__ = (
+        Index('ix_messages_timestamp', 'timestamp'),
+        Index('ix_messages_user_id_timestamp', 'user_id', 'timestamp'),
+        Index('ix_messages_chat_id_timestamp', 'chat_id', 'timestamp'),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'))
@@ -65,5 +71,39 @@ class Message(Base):
     message_text = Column(Text)
     response_text = Column(Text)
     timestamp = Column(DateTime, default=datetime.utcnow)
+    # Stable identity of the source entry, used to skip re-imported messages
+    message_hash = Column(String(64), unique=True, index=True)
     user = relationship("User", back_populates="messages")
-    chat = relationship("Chat", back_populates="messages") 
\ No newline at end of file
+    chat = relationship("Chat", back_populates="messages") 
+
+class DailyActivity(Base):
+    """Messages per user, chat and UTC day, maintained by the importer."""
+    __tablename__ = 'daily_activity'
+    __table_args__ = (
+        UniqueConstraint('user_id', 'chat_id', 'day', name='uq_daily_activity_user_chat_day'),
+        Index('ix_daily_activity_day', 'day'),
+        Index('ix_daily_activity_chat_id_day', 'chat_id', 'day'),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    chat_id = Column(Integer, ForeignKey('chats.id'), nullable=False)
+    day = Column(Date, nullable=False)
+    message_count = Column(Integer, nullable=False, default=0)
+
+class Meta(Base):
+    """Facts about the database itself, such as upgrade steps still pending."""
+    __tablename__ = 'meta'
+    
+    key = Column(String(64), primary_key=True)
+    value = Column(String(255))
+
+class Transliteration(Base):
+    __tablename__ = 'transliterations'
+    
+    id = Column(Integer, primary_key=True)
+    word = Column(String(255), unique=True)
+    transliteration = Column(String(255))
+    # True once a user has corrected the suggested transliteration
+    corrected = Column(Boolean, default=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -0,0 +1,131 @@
+"""Connection pool statistics, for sizing the pool to the real concurrency."""
+
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.pool import QueuePool
+import os
+import threading
+import time
+
+# Checkouts slower than this count as having waited for a connection
+WAIT_THRESHOLD = 0.001
+
+
+class PoolStats:
+    """Counters for one process's pool. Pools are per process, so are these."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.connects = 0
+        self.checkouts = 0
+        self.invalidations = 0
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self.peak_checked_out = 0
+        self.checked_out = 0
+
+    def record_wait(self, elapsed, timed_out=False):
+        with self.lock:
+            if timed_out:
+                self.timeouts += 1
+            if elapsed >= WAIT_THRESHOLD:
+                self.waits += 1
+                self.wait_time += elapsed
+                self.max_wait = max(self.max_wait, elapsed)
+
+    def record_checkout(self):
+        with self.lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def record_checkin(self):
+        with self.lock:
+            self.checked_out -= 1
+
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a connection.
+
+    The time includes opening a new connection when the pool has room, so
+    waits with few timeouts and a low peak_checked_out point at connect
+    latency rather than a pool that is too small.
+    """
+
+    stats = None
+
+    def _do_get(self):
+        if self.stats is None:
+            return super()._do_get()
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.stats.record_wait(time.perf_counter() - start, timed_out=True)
+            raise
+        self.stats.record_wait(time.perf_counter() - start)
+        return connection
+
+    def recreate(self):
+        # dispose() swaps in a recreated pool; keep counting into the same stats
+        pool = super().recreate()
+        pool.stats = self.stats
+        return pool
+
+
+def install_pool_stats(engine):
+    """Count connects, checkouts and invalidations on `engine`'s pool."""
+    stats = PoolStats()
+    if isinstance(engine.pool, InstrumentedQueuePool):
+        engine.pool.stats = stats
+
+    @event.listens_for(engine, 'connect')
+    def on_connect(dbapi_connection, connection_record):
+        with stats.lock:
+            stats.connects += 1
+
+    @event.listens_for(engine, 'checkout')
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        stats.record_checkout()
+
+    @event.listens_for(engine, 'checkin')
+    def on_checkin(dbapi_connection, connection_record):
+        stats.record_checkin()
+
+    @event.listens_for(engine, 'invalidate')
+    def on_invalidate(dbapi_connection, connection_record, exception):
+        with stats.lock:
+            stats.invalidations += 1
+
+    engine.pool_stats = stats
+    return stats
+
+
+def pool_status(engine):
+    """Current pool state and counters for this process, as a dict."""
+    pool = engine.pool
+    stats = getattr(engine, 'pool_stats', None)
+    status = {'pid': os.getpid(), 'pool': type(pool).__name__}
+    # Only QueuePool-style pools track size and overflow
+    for name in ('size', 'checkedin', 'checkedout', 'overflow'):
+        method = getattr(pool, name, None)
+        if callable(method):
+            status[name] = method()
+    if stats is not None:
+        with stats.lock:
+            status.update({
+                'connects': stats.connects,
+                'checkouts': stats.checkouts,
+                'peak_checked_out': stats.peak_checked_out,
+                'invalidations': stats.invalidations,
+                'waits': stats.waits,
+                'wait_time_ms': round(stats.wait_time * 1000, 1),
+                'max_wait_ms': round(stats.max_wait * 1000, 1),
+                'timeouts': stats.timeouts,
+            })
+    return status
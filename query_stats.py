@@ -0,0 +1,47 @@
+"""Per-request SQL statistics for the Flask app."""
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+import time
+
+
+def install_query_stats(app, engine, query_budget=None):
+    """Count queries and database time for every request.
+
+    The totals are available as query_stats() while the request runs, are
+    sent back in the X-DB-Query-Count and X-DB-Time-Ms headers, and a
+    warning is logged when a request runs more than `query_budget` queries.
+    """
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('query_start_time', []).append(time.perf_counter())
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info['query_start_time'].pop()
+        if has_request_context() and 'db_query_count' in g:
+            g.db_query_count += 1
+            g.db_query_time += elapsed
+
+    @app.before_request
+    def start_query_stats():
+        g.db_query_count = 0
+        g.db_query_time = 0.0
+
+    @app.after_request
+    def report_query_stats(response):
+        count, elapsed_ms = query_stats()
+        response.headers['X-DB-Query-Count'] = str(count)
+        response.headers['X-DB-Time-Ms'] = f"{elapsed_ms:.1f}"
+        if query_budget is not None and count > query_budget:
+            app.logger.warning(
+                f"Query budget exceeded for {request.path}: {count} queries "
+                f"(budget {query_budget}), {elapsed_ms:.1f} ms in database"
+            )
+        return response
+
+
+def query_stats():
+    """(query count, database time in ms) for the current request so far."""
+    return g.get('db_query_count', 0), g.get('db_query_time', 0.0) * 1000
@@ -0,0 +1,131 @@
+"""Full-text search over message and response text.
+
+PostgreSQL keeps a generated tsvector column on messages with a GIN index,
+so rows are indexed by the database as they are inserted. SQLite uses an
+FTS5 table over messages (external content, so the text is not stored
+twice) which the importer fills batch by batch with index_messages().
+Other backends fall back to an unranked substring scan.
+"""
+
+from collections import namedtuple
+from sqlalchemy import text, func, inspect, literal_column, bindparam, or_
+from sqlalchemy.sql import table, column
+from models import User, Chat, Message
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 'simple' does no stemming: chats mix English, Hindi and transliterations
+TS_CONFIG = 'simple'
+# Keep combining marks in tokens; the default splits Devanagari words at matras
+FTS5_TOKENIZER = "unicode61 categories 'L* N* Co M*'"
+
+messages_fts = table('messages_fts', column('rowid'), column('rank'))
+
+SearchResult = namedtuple(
+    'SearchResult',
+    'id message_text response_text timestamp chat_id chat_type chat_name '
+    'user_id current_username current_firstname current_lastname'
+)
+
+
+def ensure_search_index(engine):
+    """Create the search index if the database lacks it. Safe on every start."""
+    dialect = engine.dialect.name
+    inspector = inspect(engine)
+    if dialect == 'postgresql':
+        columns = {c['name'] for c in inspector.get_columns('messages')}
+        if 'search_vector' not in columns:
+            logger.info("Adding messages.search_vector")
+            with engine.begin() as conn:
+                # Computed for existing rows when the column is added
+                conn.execute(text(
+                    "ALTER TABLE messages ADD COLUMN search_vector tsvector "
+                    f"GENERATED ALWAYS AS (to_tsvector('{TS_CONFIG}', "
+                    "coalesce(message_text, '') || ' ' || coalesce(response_text, ''))) STORED"
+                ))
+        with engine.begin() as conn:
+            conn.execute(text(
+                'CREATE INDEX IF NOT EXISTS ix_messages_search_vector ON messages USING GIN (search_vector)'
+            ))
+    elif dialect == 'sqlite' and 'messages_fts' not in inspector.get_table_names():
+        logger.info("Creating messages_fts")
+        with engine.begin() as conn:
+            conn.execute(text(
+                "CREATE VIRTUAL TABLE messages_fts USING fts5("
+                "message_text, response_text, content='messages', content_rowid='id', "
+                f'tokenize="{FTS5_TOKENIZER}")'
+            ))
+            # Index messages imported before the table existed
+            conn.execute(text("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')"))
+
+
+def index_messages(db, message_hashes):
+    """Add newly inserted messages to the SQLite index. The caller commits.
+
+    A no-op where the database maintains the index itself.
+    """
+    if db.get_bind().dialect.name != 'sqlite' or not message_hashes:
+        return
+    db.execute(text(
+        'INSERT INTO messages_fts (rowid, message_text, response_text) '
+        'SELECT id, message_text, response_text FROM messages WHERE message_hash IN :hashes'
+    ).bindparams(bindparam('hashes', expanding=True)), {'hashes': list(message_hashes)})
+
+
+def clear_search_index(db):
+    """Empty the SQLite index, before all messages are deleted. The caller commits."""
+    if db.get_bind().dialect.name == 'sqlite':
+        db.execute(text("INSERT INTO messages_fts (messages_fts) VALUES ('delete-all')"))
+
+
+def fts5_query(query_text):
+    """Free text -> FTS5 query matching every word, with no operator syntax."""
+    terms = query_text.split()
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def search_messages(db, query_text, limit, offset=0, cutoff_date=None):
+    """Messages matching every word of `query_text`, best match first.
+
+    Returns ([SearchResult, ...], has_more).
+    """
+    if not query_text.split():
+        return [], False
+
+    columns = (Message.id, Message.message_text, Message.response_text, Message.timestamp,
+               Chat.chat_id, Chat.chat_type, Chat.chat_name,
+               User.user_id, User.current_username, User.current_firstname, User.current_lastname)
+    dialect = db.get_bind().dialect.name
+    if dialect == 'postgresql':
+        vector = literal_column('messages.search_vector')
+        tsquery = func.websearch_to_tsquery(literal_column(f"'{TS_CONFIG}'::regconfig"),
+                                            bindparam('search_query', query_text))
+        rank = func.ts_rank_cd(vector, tsquery)
+        query = (db.query(*columns)
+                 .select_from(Message)
+                 .filter(vector.op('@@')(tsquery))
+                 .order_by(rank.desc(), Message.id.desc()))
+    elif dialect == 'sqlite':
+        query = (db.query(*columns)
+                 .select_from(messages_fts)
+                 .join(Message, Message.id == messages_fts.c.rowid)
+                 .filter(text('messages_fts MATCH :search_query'))
+                 # FTS5's rank is bm25(): lower is better
+                 .order_by(messages_fts.c.rank, Message.id.desc())
+                 .params(search_query=fts5_query(query_text)))
+    else:
+        query = db.query(*columns).select_from(Message)
+        for term in query_text.split():
+            pattern = f"%{term}%"
+            query = query.filter(or_(Message.message_text.ilike(pattern),
+                                     Message.response_text.ilike(pattern)))
+        query = query.order_by(Message.timestamp.desc(), Message.id.desc())
+
+    query = (query.join(Chat, Message.chat_id == Chat.id)
+             .join(User, Message.user_id == User.id))
+    if cutoff_date is not None:
+        query = query.filter(Message.timestamp >= cutoff_date)
+
+    rows = query.limit(limit + 1).offset(offset).all()
+    return [SearchResult(*row) for row in rows[:limit]], len(rows) > limit
@@ -1,6 +1,9 @@
 function updateFilters(type, value) {
     const urlParams = new URLSearchParams(window.location.search);
     urlParams.set(type, value);
+    // A new filter starts again from the first page
+    urlParams.delete('after');
+    urlParams.delete('before');
     window.location.search = urlParams.toString();
 }
 
@@ -8,11 +11,108 @@ function toggleChat(chatId) {
     const content = document.getElementById(`chat-content-${chatId}`);
     if (content.style.display === 'none') {
         content.style.display = 'block';
+        // Bodies are fetched on first expand and kept in the page afterwards
+        if (!content.dataset.loaded) {
+            content.dataset.loaded = 'true';
+            loadMessages(content, content.dataset.messagesUrl);
+        }
     } else {
         content.style.display = 'none';
     }
 }
 
+function loadMessages(content, url) {
+    const status = document.createElement('div');
+    status.className = 'text-muted';
+    status.textContent = 'Loading...';
+    content.appendChild(status);
+
+    fetch(url, { credentials: 'same-origin' })
+        .then(response => {
+            if (!response.ok) {
+                throw new Error(`HTTP ${response.status}`);
+            }
+            return response.json();
+        })
+        .then(page => {
+            status.remove();
+            page.messages.forEach(message => content.appendChild(renderMessage(message)));
+            if (page.messages.length === 0 && !content.querySelector('.message')) {
+                const empty = document.createElement('div');
+                empty.className = 'text-muted';
+                empty.textContent = 'No messages';
+                content.appendChild(empty);
+            }
+            if (page.next_cursor) {
+                const more = document.createElement('button');
+                more.className = 'btn btn-sm btn-outline-secondary';
+                more.textContent = 'Load older messages';
+                more.onclick = () => {
+                    more.remove();
+                    const nextUrl = new URL(content.dataset.messagesUrl, window.location.origin);
+                    nextUrl.searchParams.set('cursor', page.next_cursor);
+                    loadMessages(content, nextUrl.toString());
+                };
+                content.appendChild(more);
+            }
+        })
+        .catch(() => {
+            status.textContent = 'Could not load messages';
+            delete content.dataset.loaded;
+        });
+}
+
+function element(tag, className, text) {
+    const node = document.createElement(tag);
+    if (className) {
+        node.className = className;
+    }
+    if (text !== undefined && text !== null) {
+        node.textContent = text;
+    }
+    return node;
+}
+
+function labelled(className, label, text) {
+    const node = element('div', className);
+    node.appendChild(element('strong', null, `${label}:`));
+    node.appendChild(document.createTextNode(` ${text ?? ''}`));
+    return node;
+}
+
+function renderMessage(message) {
+    const node = element('div', 'message');
+
+    if (message.user) {
+        const user = message.user;
+        const info = element('div', 'user-info');
+        info.appendChild(element('span', 'username', [user.firstname, user.lastname].filter(Boolean).join(' ')));
+        if (user.username) {
+            info.appendChild(element('span', 'usertag', user.username));
+        }
+        const userId = element('span', 'user-id', `(ID: ${user.user_id})`);
+        userId.onclick = () => copyToClipboard(user.user_id);
+        info.appendChild(userId);
+        if (user.previous_names.length) {
+            const previous = element('div', 'previous-names', 'Previous: ');
+            user.previous_names.forEach(name => {
+                let text = [name.firstname, name.lastname].filter(Boolean).join(' ');
+                if (name.username) {
+                    text += ` (${name.username})`;
+                }
+                previous.appendChild(element('span', 'badge bg-secondary', text));
+            });
+            info.appendChild(previous);
+        }
+        node.appendChild(info);
+    }
+
+    node.appendChild(labelled('message-text', 'Message', message.message_text));
+    node.appendChild(labelled('response-text', 'Response', message.response_text));
+    node.appendChild(element('small', 'text-muted', message.timestamp));
+    return node;
+}
+
 function copyToClipboard(text) {
     navigator.clipboard.writeText(text).then(() => {
         showToast('Copied to clipboard!');
@@ -0,0 +1,61 @@
+"""Exports must parse back into the entries they were made from."""
+
+from datetime import datetime
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy.orm import sessionmaker
+from export import iter_export
+from history import HEADER, iter_history, parse_history
+from ingest import BulkLoader
+from init_db import create_db_engine, upgrade_schema
+from models import Base
+
+ENTRIES = [
+    {'Time': '2024-01-05 10:00:00.123000', 'Chat ID': '-100', 'Chat Type': 'supergroup',
+     'Chat Name': 'Group', 'User ID': '1', 'Username': '@alice', 'First Name': 'Alice',
+     'Last Name': None, 'Message': 'hello\nsecond line: with colon', 'Response': 'ok'},
+    {'Time': '2024-01-05 11:00:00', 'Chat ID': '2', 'Chat Type': 'private',
+     'Chat Name': None, 'User ID': '2', 'Username': None, 'First Name': 'Bob',
+     'Last Name': 'Smith', 'Message': 'नमस्ते kitab*', 'Response': None},
+]
+
+FIELDS = ['Time', 'Chat ID', 'Chat Type', 'Chat Name', 'User ID', 'Username',
+          'First Name', 'Last Name', 'Message', 'Response']
+
+
+def as_row(entry):
+    return (entry['Time'], entry['Chat ID'], entry['Chat Type'], entry['Chat Name'], entry['User ID'],
+            entry['Username'], entry['First Name'], entry['Last Name'], entry['Message'], entry['Response'])
+
+
+def parsed(text):
+    return [{field: entry.get(field) for field in FIELDS}
+            for _, entry in parse_history(text.splitlines())]
+
+
+def test_format_round_trip():
+    text = HEADER + "\n\n" + ''.join(iter_history(as_row(entry) for entry in ENTRIES))
+    assert parsed(text) == ENTRIES
+
+
+def test_export_round_trip(tmp_path):
+    engine = create_db_engine(f"sqlite:///{tmp_path / 'export.sqlite'}")
+    Base.metadata.create_all(engine)
+    upgrade_schema(engine)
+    with sessionmaker(bind=engine)() as db:
+        loader = BulkLoader(db)
+        for num, entry in enumerate(ENTRIES, 1):
+            loader.add(num, dict(entry))
+        loader.flush()
+        db.commit()
+        text = ''.join(iter_export(db))
+    engine.dispose()
+
+    exported = parsed(text)
+    for entry in exported:
+        entry['Time'] = str(datetime.fromisoformat(entry['Time']))
+    expected = [dict(entry, Time=str(datetime.fromisoformat(entry['Time']))) for entry in ENTRIES]
+    assert exported == expected
@@ -0,0 +1,196 @@
+"""Devanagari to Roman transliteration."""
+
+from collections import OrderedDict
+from sqlalchemy import select
+from models import Transliteration
+from ingest import dialect_insert, chunked
+import re
+import threading
+
+# Longest word/transliteration the transliterations table can hold
+MAX_WORD_LENGTH = 255
+
+
+class Transliterator:
+    """Longest-match transliteration over a fixed mapping table.
+
+    The table is compiled once into a first-character index: for each
+    character that starts a key, the lengths of the keys starting with it,
+    longest first. Transliterating then costs a few dict lookups per
+    character, and multi-character keys such as 'श्री' or 'वाला' win over
+    their single-character parts.
+    """
+
+    def __init__(self, table):
+        self.table = dict(table)
+        lengths = {}
+        for key in self.table:
+            if key:
+                lengths.setdefault(key[0], set()).add(len(key))
+        self.lengths = {char: sorted(sizes, reverse=True) for char, sizes in lengths.items()}
+
+    def transliterate(self, text):
+        table = self.table
+        index = self.lengths
+        out = []
+        i = 0
+        end = len(text)
+        while i < end:
+            char = text[i]
+            sizes = index.get(char)
+            if sizes is not None:
+                for size in sizes:
+                    piece = text[i:i + size] if size > 1 else char
+                    if piece in table:
+                        out.append(table[piece])
+                        i += size
+                        break
+                else:
+                    out.append(char)
+                    i += 1
+            else:
+                out.append(char)
+                i += 1
+        return ''.join(out)
+
+
+class TransliterationStore:
+    """Known transliterations, persisted in the database with an LRU in front.
+
+    Words reviewed in earlier uploads, and corrections users sent, are
+    resolved from here so only genuinely new words are transliterated and
+    shown for review.
+    """
+
+    def __init__(self, capacity=50000):
+        self.capacity = capacity
+        self.cache = OrderedDict()
+        # Lookups and saves run in worker threads, several uploads at a time
+        self.lock = threading.Lock()
+
+    def _remember(self, word, transliteration):
+        with self.lock:
+            self.cache[word] = transliteration
+            self.cache.move_to_end(word)
+            if len(self.cache) > self.capacity:
+                self.cache.popitem(last=False)
+
+    def lookup(self, db, words):
+        """Return {word: transliteration} for the words already known."""
+        known = {}
+        misses = []
+        with self.lock:
+            for word in words:
+                if word in self.cache:
+                    self.cache.move_to_end(word)
+                    known[word] = self.cache[word]
+                elif len(word) <= MAX_WORD_LENGTH:
+                    misses.append(word)
+
+        for chunk in chunked(misses):
+            rows = db.execute(
+                select(Transliteration.word, Transliteration.transliteration)
+                .where(Transliteration.word.in_(chunk))
+            )
+            for word, transliteration in rows:
+                known[word] = transliteration
+                self._remember(word, transliteration)
+        return known
+
+    def save(self, db, transliterations, corrected=False):
+        """Persist transliterations. The caller commits.
+
+        Corrections overwrite what is stored; accepted suggestions never
+        replace an existing entry, so they cannot undo an earlier correction.
+        """
+        values = [{'word': word, 'transliteration': transliteration, 'corrected': corrected}
+                  for word, transliteration in transliterations.items()
+                  if len(word) <= MAX_WORD_LENGTH and len(transliteration) <= MAX_WORD_LENGTH]
+        if not values:
+            return
+
+        stmt = dialect_insert(db, Transliteration.__table__)
+        if stmt is None:
+            # No upsert construct: fall back to the ORM, one merge per word
+            for value in values:
+                existing = db.query(Transliteration).filter_by(word=value['word']).first()
+                if existing is None:
+                    db.add(Transliteration(**value))
+                elif corrected:
+                    existing.transliteration = value['transliteration']
+                    existing.corrected = True
+        elif corrected:
+            db.execute(stmt.on_conflict_do_update(
+                index_elements=['word'],
+                set_={
+                    'transliteration': stmt.excluded.transliteration,
+                    'corrected': True,
+                    'updated_at': stmt.excluded.updated_at,
+                },
+            ), values)
+        else:
+            db.execute(stmt.on_conflict_do_nothing(index_elements=['word']), values)
+
+        # Drop cached entries; the next lookup reads what actually got stored
+        with self.lock:
+            for value in values:
+                self.cache.pop(value['word'], None)
+
+
+class Replacer:
+    """Rewrite every occurrence of a set of words in a single pass.
+
+    The words are compiled into one regex shaped like a trie, so each
+    position in the text is tested against at most one branch per
+    character. Where words overlap, the longest match at a position wins,
+    independent of dict order. Words longer than MAX_WORD_LENGTH, which
+    would nest the regex too deeply, are replaced with str.replace first,
+    longest first.
+    """
+
+    def __init__(self, replacements):
+        self.replacements = {word: value for word, value in replacements.items()
+                             if word and len(word) <= MAX_WORD_LENGTH}
+        self.long_words = sorted(((word, value) for word, value in replacements.items()
+                                  if len(word) > MAX_WORD_LENGTH), key=lambda item: -len(item[0]))
+        self.pattern = re.compile(_trie_pattern(self.replacements)) if self.replacements else None
+
+    def replace(self, text):
+        if not text:
+            return text
+        for word, value in self.long_words:
+            text = text.replace(word, value)
+        if self.pattern is None:
+            return text
+        replacements = self.replacements
+        return self.pattern.sub(lambda match: replacements[match.group()], text)
+
+
+def _trie_pattern(words):
+    trie = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[''] = True
+
+    # Post-order without recursion: a node's pattern is built after its children's
+    patterns = {}
+    stack = [(trie, False)]
+    while stack:
+        node, children_done = stack.pop()
+        if not children_done:
+            stack.append((node, True))
+            stack.extend((child, False) for char, child in node.items() if char)
+            continue
+        branches = [re.escape(char) + patterns.pop(id(child))
+                    for char, child in sorted(node.items()) if char]
+        if not branches:
+            pattern = ''
+        else:
+            pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+            # A word ends here but longer ones continue: the greedy ? prefers them
+            if '' in node:
+                pattern = '(?:' + pattern + ')?'
+        patterns[id(node)] = pattern
+    return patterns[id(trie)]
@@ -0,0 +1,64 @@
+"""Uploaded documents, downloaded once and parsed without further copies."""
+
+from history import iter_lines
+import mmap
+import os
+import tempfile
+
+# Uploads up to this many bytes are kept in memory; larger ones go to a temp file
+IN_MEMORY_UPLOAD_LIMIT = int(os.environ.get('IN_MEMORY_UPLOAD_LIMIT', 20 * 1024 * 1024))
+
+
+class Upload:
+    """One downloaded document: a bytearray, or a temp file read through mmap.
+
+    lines() can be called once per pass over the document; every pass
+    reads the same download. Call close() when done with it.
+    """
+
+    def __init__(self, buffer=None, path=None):
+        self.buffer = buffer
+        self.path = path
+
+    @classmethod
+    async def download(cls, telegram_file, size=None, limit=IN_MEMORY_UPLOAD_LIMIT):
+        """Download a telegram File once, to memory if `size` is known and small enough."""
+        if size is not None and size <= limit:
+            return cls(buffer=await telegram_file.download_as_bytearray())
+
+        with tempfile.NamedTemporaryFile(delete=False, suffix='.txt') as temp_file:
+            path = temp_file.name
+        try:
+            await telegram_file.download_to_drive(path)
+        except BaseException:
+            os.unlink(path)
+            raise
+        return cls(path=path)
+
+    @property
+    def available(self):
+        return self.buffer is not None or (self.path is not None and os.path.exists(self.path))
+
+    @property
+    def size(self):
+        if self.buffer is not None:
+            return len(self.buffer)
+        return os.path.getsize(self.path)
+
+    def lines(self):
+        """Yield the document's text lines."""
+        if self.buffer is not None:
+            yield from iter_lines(self.buffer)
+            return
+        # mmap cannot map an empty file
+        if not self.size:
+            return
+        with open(self.path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield from iter_lines(mapped)
+
+    def close(self):
+        """Release the buffer or delete the temp file."""
+        self.buffer = None
+        path, self.path = self.path, None
+        if path and os.path.exists(path):
+            os.unlink(path)
@@ -0,0 +1,176 @@
+"""Benchmark the import pipeline on a synthetic history file.
+
+Drives Bot's parse, scan (Hindi detection and transliteration) and
+database write stages directly, without Telegram, and saves entries/sec,
+per-stage timings and peak RSS as JSON so runs can be compared.
+
+    python utils/bench_ingest.py --entries 100000 --hindi-ratio 0.3
+    python utils/bench_ingest.py --database-url postgresql://localhost/bench --entries 1000000
+"""
+
+from datetime import datetime, timezone
+import argparse
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import logging
+
+# Add parent directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Keep the benchmark away from the dashboard's real cache file
+os.environ.setdefault('DASHBOARD_CACHE_PATH', os.path.join(tempfile.gettempdir(), 'bench_dashboard_cache.sqlite'))
+
+import sqlalchemy
+from sqlalchemy.orm import sessionmaker
+from models import Base
+from init_db import create_db_engine, upgrade_schema
+import bot as bot_module
+from synth_history import write_history, add_arguments, params_from_args
+
+
+def peak_rss_mb():
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+class Stages:
+    """Wall time and peak RSS after each named stage."""
+
+    def __init__(self):
+        self.results = {}
+
+    def run(self, name, count, fn, *args, **kwargs):
+        """Time fn(*args, **kwargs), which handles `count` entries."""
+        start = time.perf_counter()
+        result = fn(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        self.results[name] = {
+            'seconds': round(seconds, 3),
+            'entries_per_sec': round(count / seconds, 1) if seconds else None,
+            'peak_rss_mb': peak_rss_mb(),
+        }
+        print(f"{name:>10}: {seconds:8.2f}s  {self.results[name]['entries_per_sec'] or 0:>10} entries/s")
+        return result
+
+
+def count_entries(bot, filename):
+    return sum(1 for _ in bot.read_history_file(filename))
+
+
+def import_file(bot, session_factory, filename, transliterations, mode):
+    with session_factory() as db:
+        loader = bot.import_entries(db, bot.read_history_file(filename), transliterations, mode=mode)
+        start = time.perf_counter()
+        db.commit()
+        return loader, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    add_arguments(parser)
+    parser.add_argument('--database-url', help='default: a fresh SQLite file in a temp directory')
+    parser.add_argument('--history', help='use this history file instead of generating one')
+    parser.add_argument('--mode', choices=['merge', 'replace'], default='replace')
+    parser.add_argument('--batch-size', type=int, help='BulkLoader batch size (default IMPORT_BATCH_SIZE)')
+    parser.add_argument('--reimport', action='store_true',
+                        help='import the file a second time in merge mode (every entry a duplicate)')
+    parser.add_argument('--output', help='JSON results path (default ingest_bench_<timestamp>.json)')
+    parser.add_argument('--keep', action='store_true', help='keep the generated file and SQLite database')
+    args = parser.parse_args()
+
+    # Per-entry import logging would dominate the timings
+    logging.basicConfig(level=logging.WARNING)
+
+    workdir = tempfile.mkdtemp(prefix='bench_ingest_')
+    database_url = args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.sqlite')}"
+    engine = create_db_engine(database_url)
+    Base.metadata.create_all(engine)
+    upgrade_schema(engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+    bot = bot_module.Bot(session_factory=session_factory)
+    if args.batch_size:
+        bot_module.IMPORT_BATCH_SIZE = args.batch_size
+
+    stages = Stages()
+    params = params_from_args(args)
+    if args.history:
+        filename = args.history
+        params = {'history': os.path.abspath(args.history)}
+    else:
+        filename = os.path.join(workdir, 'temp_history.txt')
+        stages.run('generate', args.entries, write_history, filename, **params)
+    file_bytes = os.path.getsize(filename)
+
+    entries = count_entries(bot, filename) if args.history else args.entries
+    stages.run('parse', entries, count_entries, bot, filename)
+    entry_count, known, new = stages.run('scan', entries, bot.scan_history_file, filename)
+    transliterations = {**known, **new}
+    loader, commit_seconds = stages.run('import', entries, import_file, bot, session_factory,
+                                        filename, transliterations, args.mode)
+    stages.results['import']['commit_seconds'] = round(commit_seconds, 3)
+    counters = {
+        'valid_entries': loader.valid_entries,
+        'skipped_entries': loader.skipped_entries,
+        'new_entries': loader.new_entries,
+        'duplicate_entries': loader.duplicate_entries,
+        'rows_written': loader.rows_written,
+    }
+    if args.reimport:
+        reloader, _ = stages.run('reimport', entries, import_file, bot, session_factory,
+                                 filename, transliterations, 'merge')
+        counters['reimport_duplicate_entries'] = reloader.duplicate_entries
+
+    # What the bot runs for an upload; the standalone parse pass is reported on its own
+    pipeline = ['scan', 'import']
+    total = sum(stages.results[name]['seconds'] for name in pipeline)
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'git_commit': git_commit(),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        'database': engine.dialect.name,
+        'mode': args.mode,
+        'params': params,
+        'file_bytes': file_bytes,
+        'entries': entry_count,
+        'hindi_words': {'known': len(known), 'new': len(new)},
+        'counters': counters,
+        'stages': stages.results,
+        # Scan and import each parse the file, as the bot does
+        'pipeline': pipeline,
+        'pipeline_seconds': round(total, 3),
+        'entries_per_sec': round(entries / total, 1) if total else None,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+    output = args.output or f"ingest_bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"{entries} entries, {results['entries_per_sec']} entries/s overall, "
+          f"peak RSS {results['peak_rss_mb']} MB; results in {output}")
+
+    engine.dispose()
+    if args.keep:
+        print(f"Kept {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
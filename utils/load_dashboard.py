@@ -0,0 +1,232 @@
+"""Load test the dashboard at several data scales.
+
+Seeds a database per scale with synthetic history, then sends concurrent
+authenticated requests for every view x days combination through the
+Flask app and reports latency percentiles, throughput, query counts and
+response sizes per combination. Results are saved as JSON.
+
+    python utils/load_dashboard.py --scales 10k,1m --requests 50 --concurrency 4
+    python utils/load_dashboard.py --database-url postgresql://localhost/load --scales 1m
+
+SQLite databases are kept in --data-dir and reused when they already hold
+the right number of messages. A --database-url database is wiped and
+reseeded for every scale.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import logging
+
+# Add parent directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+VIEWS = ['users', 'groups', 'total']
+DAYS = ['today', '3days', '7days', 'forever']
+# Mean gap between synthetic messages, so the newest land around now
+MEAN_GAP_SECONDS = 15.5
+COMMIT_EVERY = 100000
+
+
+def parse_scale(value):
+    value = value.strip().lower()
+    for suffix, factor in (('k', 1000), ('m', 1000000)):
+        if value.endswith(suffix):
+            return int(float(value[:-len(suffix)]) * factor)
+    return int(value)
+
+
+def seed(database_url, messages, users, chats, wipe):
+    """Fill the database with `messages` synthetic messages ending about now."""
+    from sqlalchemy import select, func
+    from sqlalchemy.orm import sessionmaker
+    from models import Base, Message
+    from init_db import create_db_engine, upgrade_schema
+    from ingest import BulkLoader
+    from synth_history import synth_entries
+
+    engine = create_db_engine(database_url)
+    if wipe:
+        Base.metadata.drop_all(engine)
+    Base.metadata.create_all(engine)
+    upgrade_schema(engine)
+    session_factory = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+    with session_factory() as db:
+        existing = db.execute(select(func.count(Message.id))).scalar()
+    if existing == messages:
+        print(f"Reusing {messages} messages in {database_url}")
+        engine.dispose()
+        return
+    if existing:
+        raise SystemExit(f"{database_url} holds {existing} messages, expected 0 or {messages}")
+
+    print(f"Seeding {messages} messages...")
+    start = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(seconds=MEAN_GAP_SECONDS * messages)
+    started = time.perf_counter()
+    db = session_factory()
+    loader = BulkLoader(db)
+    try:
+        entries = synth_entries(entries=messages, users=users, chats=chats, hindi_ratio=0, start=start)
+        for num, (timestamp, chat_id, chat_type, chat_name, user_id, username,
+                  firstname, lastname, message, response) in enumerate(entries, 1):
+            loader.add(num, {
+                'Time': str(timestamp), 'Chat ID': chat_id, 'Chat Type': chat_type,
+                'Chat Name': chat_name, 'User ID': user_id, 'Username': username,
+                'First Name': firstname, 'Last Name': lastname,
+                'Message': message, 'Response': response,
+            })
+            if num % COMMIT_EVERY == 0:
+                loader.flush()
+                db.commit()
+                print(f"  {num} messages, {num / (time.perf_counter() - started):.0f}/s")
+        loader.flush()
+        db.commit()
+    finally:
+        db.close()
+        engine.dispose()
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def run_scale(database_url, workdir, requests, concurrency, use_cache, extra_params, results):
+    """Drive every combination through the app. Runs in a fresh process."""
+    os.environ['DATABASE_URL'] = database_url
+    os.environ['FLASK_SECRET_KEY'] = 'load-test'
+    os.environ['DASHBOARD_CACHE_PATH'] = os.path.join(workdir, 'dashboard_cache.sqlite')
+    if not use_cache:
+        # Nothing stored or read, so requests do not contend on the cache file
+        os.environ['DASHBOARD_CACHE_MAX_BYTES'] = '0'
+    # The app logs to ./logs; keep that out of the working tree
+    os.chdir(workdir)
+    import app as dashboard_app
+
+    local = threading.local()
+
+    def client():
+        if not hasattr(local, 'client'):
+            local.client = dashboard_app.app.test_client()
+            with local.client.session_transaction() as session:
+                session['authenticated'] = True
+        return local.client
+
+    def fetch(url):
+        start = time.perf_counter()
+        response = client().get(url)
+        body = response.get_data()
+        return {
+            'latency': time.perf_counter() - start,
+            'status': response.status_code,
+            'size': len(body),
+            'queries': int(response.headers.get('X-DB-Query-Count', 0)),
+            'db_ms': float(response.headers.get('X-DB-Time-Ms', 0)),
+        }
+
+    combos = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for view in VIEWS:
+            for days in DAYS:
+                url = f"/dashboard?view={view}&days={days}{extra_params}"
+                fetch(url)  # warm up: first connection, template compilation
+                started = time.perf_counter()
+                samples = list(pool.map(fetch, [url] * requests))
+                elapsed = time.perf_counter() - started
+
+                latencies = sorted(sample['latency'] * 1000 for sample in samples)
+                combos[f"{view}/{days}"] = {
+                    'p50_ms': round(percentile(latencies, 50), 1),
+                    'p95_ms': round(percentile(latencies, 95), 1),
+                    'p99_ms': round(percentile(latencies, 99), 1),
+                    'mean_ms': round(statistics.mean(latencies), 1),
+                    'throughput_rps': round(requests / elapsed, 1),
+                    'errors': sum(1 for sample in samples if sample['status'] != 200),
+                    'queries': max(sample['queries'] for sample in samples),
+                    'db_ms_mean': round(statistics.mean(sample['db_ms'] for sample in samples), 1),
+                    'response_bytes': max(sample['size'] for sample in samples),
+                }
+    results.put(combos)
+
+
+def print_table(scale, combos):
+    print(f"\n{scale} messages")
+    print(f"{'view/days':<16}{'p50':>9}{'p95':>9}{'p99':>9}{'req/s':>9}{'queries':>9}{'db ms':>9}{'bytes':>11}{'errors':>8}")
+    for name, row in combos.items():
+        print(f"{name:<16}{row['p50_ms']:>9}{row['p95_ms']:>9}{row['p99_ms']:>9}{row['throughput_rps']:>9}"
+              f"{row['queries']:>9}{row['db_ms_mean']:>9}{row['response_bytes']:>11}{row['errors']:>8}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', default='10k,1m,10m', help='message counts, e.g. 10k,1m,10m')
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--chats', type=int, default=200, help='number of group chats')
+    parser.add_argument('--requests', type=int, default=50, help='requests per combination')
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--cache', action='store_true', help='let the dashboard cache serve repeats')
+    parser.add_argument('--params', default='', help="extra query string, e.g. '&preview=3'")
+    parser.add_argument('--database-url', help='wiped and reseeded for every scale')
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'load_dashboard'),
+                        help='SQLite databases, reused between runs')
+    parser.add_argument('--output', help='JSON results path (default load_dashboard_<timestamp>.json)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    os.makedirs(args.data_dir, exist_ok=True)
+    output = os.path.abspath(
+        args.output or f"load_dashboard_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    )
+
+    results = {
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'cache': args.cache,
+        'params': args.params,
+        'scales': {},
+    }
+    # A fresh interpreter per scale, so the app binds to that scale's database
+    context = multiprocessing.get_context('spawn')
+    for scale in args.scales.split(','):
+        messages = parse_scale(scale)
+        if args.database_url:
+            database_url = args.database_url
+        else:
+            database_url = f"sqlite:///{os.path.join(args.data_dir, f'dashboard_{messages}.sqlite')}"
+        seed(database_url, messages, args.users, args.chats, wipe=bool(args.database_url))
+
+        combos_queue = context.Queue()
+        worker = context.Process(target=run_scale, args=(database_url, args.data_dir, args.requests,
+                                                         args.concurrency, args.cache, args.params, combos_queue))
+        worker.start()
+        while True:
+            try:
+                combos = combos_queue.get(timeout=1)
+                break
+            except queue.Empty:
+                if not worker.is_alive():
+                    raise SystemExit(f"Load run for {messages} messages failed")
+        worker.join()
+        results['scales'][messages] = combos
+        print_table(messages, combos)
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"\nResults in {output}")
+
+
+if __name__ == "__main__":
+    main()
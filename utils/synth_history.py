@@ -0,0 +1,125 @@
+"""Generate synthetic temp_history.txt files for benchmarks.
+
+    python utils/synth_history.py out.txt --entries 100000 --users 500 \
+        --chats 50 --hindi-ratio 0.3 --multiline-ratio 0.1
+"""
+
+from datetime import datetime, timedelta
+import argparse
+import os
+import random
+import sys
+
+# Add parent directory to Python path
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from history import HEADER, iter_history
+
+CONSONANTS = 'कखगघचछजझटठडढतथदधनपफबभमयरलवशसह'
+MATRAS = ['', 'ा', 'ि', 'ी', 'ु', 'ू', 'े', 'ै', 'ो', 'ौ', 'ं']
+ENGLISH_WORDS = (
+    'hello ok thanks please what when where why how yes no maybe today tomorrow '
+    'message reply later sure good bad great call send file photo link meeting'
+).split()
+
+
+def hindi_vocabulary(size, rng):
+    """`size` distinct pseudo-Hindi words of two to four syllables."""
+    words = set()
+    while len(words) < size:
+        syllables = rng.randint(2, 4)
+        words.add(''.join(rng.choice(CONSONANTS) + rng.choice(MATRAS) for _ in range(syllables)))
+    return sorted(words)
+
+
+def make_text(rng, vocabulary, hindi, lines):
+    out = []
+    for _ in range(lines):
+        words = [rng.choice(ENGLISH_WORDS) for _ in range(rng.randint(3, 12))]
+        if hindi:
+            for _ in range(rng.randint(1, 4)):
+                words.insert(rng.randrange(len(words) + 1), rng.choice(vocabulary))
+        out.append(' '.join(words))
+    return '\n'.join(out)
+
+
+def synth_entries(entries=10000, users=200, chats=20, private_ratio=0.5, hindi_ratio=0.3,
+                  multiline_ratio=0.1, hindi_vocab=2000, rename_ratio=0.01, seed=1,
+                  start=datetime(2024, 1, 1)):
+    """Yield format_entry() tuples for a synthetic history.
+
+    Each entry is from a random one of `users`, in their private chat with
+    probability `private_ratio` and otherwise in one of `chats` groups.
+    `hindi_ratio` of messages contain Hindi words drawn from a vocabulary
+    of `hindi_vocab` words, `multiline_ratio` have two to four lines, and
+    `rename_ratio` of entries come from a user who just changed their name.
+    """
+    rng = random.Random(seed)
+    vocabulary = hindi_vocabulary(hindi_vocab, rng) if hindi_ratio else []
+    names = {user: 0 for user in range(users)}
+    timestamp = start
+
+    for i in range(entries):
+        timestamp += timedelta(seconds=rng.randint(1, 30), microseconds=rng.randint(0, 999999))
+        user = rng.randrange(users)
+        if rng.random() < rename_ratio:
+            names[user] += 1
+        version = f"_{names[user]}" if names[user] else ''
+
+        if rng.random() < private_ratio:
+            chat_id, chat_type, chat_name = str(1000000 + user), 'private', None
+        else:
+            group = rng.randrange(chats)
+            chat_id, chat_type, chat_name = str(-1000000 - group), 'supergroup', f"Group {group}"
+
+        lines = rng.randint(2, 4) if rng.random() < multiline_ratio else 1
+        hindi = rng.random() < hindi_ratio
+        message = f"#{i} " + make_text(rng, vocabulary, hindi, lines)
+        response = make_text(rng, vocabulary, hindi and rng.random() < 0.5, 1)
+
+        yield (timestamp, chat_id, chat_type, chat_name, str(1000000 + user),
+               f"@user{user}{version}", f"First{user}{version}", f"Last{user}",
+               message, response)
+
+
+def write_history(path, **params):
+    """Write a synthetic history to `path`. Returns its size in bytes."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(HEADER + "\n\n")
+        f.writelines(iter_history(synth_entries(**params)))
+    return os.path.getsize(path)
+
+
+def add_arguments(parser):
+    parser.add_argument('--entries', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=200)
+    parser.add_argument('--chats', type=int, default=20, help='number of group chats')
+    parser.add_argument('--private-ratio', type=float, default=0.5)
+    parser.add_argument('--hindi-ratio', type=float, default=0.3)
+    parser.add_argument('--multiline-ratio', type=float, default=0.1)
+    parser.add_argument('--hindi-vocab', type=int, default=2000, help='distinct Hindi words')
+    parser.add_argument('--rename-ratio', type=float, default=0.01)
+    parser.add_argument('--seed', type=int, default=1)
+
+
+def params_from_args(args):
+    return {
+        'entries': args.entries,
+        'users': args.users,
+        'chats': args.chats,
+        'private_ratio': args.private_ratio,
+        'hindi_ratio': args.hindi_ratio,
+        'multiline_ratio': args.multiline_ratio,
+        'hindi_vocab': args.hindi_vocab,
+        'rename_ratio': args.rename_ratio,
+        'seed': args.seed,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('output')
+    add_arguments(parser)
+    args = parser.parse_args()
+    size = write_history(args.output, **params_from_args(args))
+    print(f"Wrote {args.entries} entries ({size} bytes) to {args.output}")
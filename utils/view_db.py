@@ -1,4 +1,4 @@
-from sqlalchemy import create_engine, inspect, text
+from sqlalchemy import inspect, text
 import os
 from dotenv import load_dotenv
 import sys
@@ -6,13 +6,13 @@ import sys
 # Add parent directory to Python path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from init_db import create_db_engine
+
 # Load environment variables
 load_dotenv()
 
-DATABASE_URL = os.environ.get('DATABASE_URL')
-
 def view_table_info():
-    engine = create_engine(DATABASE_URL)
+    engine = create_db_engine()
     inspector = inspect(engine)
     
     # Get all tables